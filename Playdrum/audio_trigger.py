@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from latency_trace import TRACER, STAGE_MIXER, LatencyHistogram
+
+
+class AudioTriggerWorker:
+    """
+    常驻的播放触发线程：击打以批为单位放入 SimpleQueue（put 不阻塞、无需额外加锁），
+    由同一个线程依次调用 DrumPlayer.play。同一刻度上的击打作为一批提交，在同一次唤醒中连续触发，
+    落在同一个混音帧内。thread_per_hit=True 时沿用旧做法（每次击打新建一个线程），用于对比。
+    """
+
+    def __init__(self, player, thread_per_hit=False):
+        """
+        :param player: DrumPlayer（或任何提供 play(drum_name, velocity) 的对象）
+        :param thread_per_hit: 每次击打新建线程（旧实现，仅用于对比测量）
+        """
+        self.player = player
+        self.thread_per_hit = thread_per_hit
+        self.latency = LatencyHistogram()  # 提交到调用 play 之间的延迟
+        self.threads_created = 0
+        self.batches = 0
+        self.hits = 0
+        self.errors = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        if not thread_per_hit:
+            self._thread = threading.Thread(target=self._run, name="audio-trigger", daemon=True)
+            self._thread.start()
+            self.threads_created += 1
+
+    # ---------------- 外部接口 ----------------
+    def trigger(self, drum_name: str, velocity=None, trace_id=None):
+        """提交一次击打（非阻塞）"""
+        self.trigger_batch([(drum_name, velocity, trace_id)])
+
+    def trigger_batch(self, hits):
+        """提交同一时刻的一批击打 [(drum_name, velocity, trace_id), ...]（非阻塞）"""
+        submitted_ns = time.perf_counter_ns()
+        if self.thread_per_hit:
+            for hit in hits:
+                threading.Thread(target=self._play_batch, args=([hit], submitted_ns), daemon=True).start()
+                self.threads_created += 1
+            return
+        self._queue.put((hits, submitted_ns))
+
+    def stats(self):
+        return {
+            "threads_created": self.threads_created,
+            "batches": self.batches,
+            "hits": self.hits,
+            "errors": self.errors,
+            "latency": self.latency.summary(),
+        }
+
+    def print_stats(self, label: str):
+        self.latency.print_summary(f"[{label}] 触发延迟（{self.batches} 批 {self.hits} 次击打，"
+                                   f"创建线程 {self.threads_created} 个）")
+
+    def close(self, timeout=1.0):
+        """处理完已提交的击打后退出"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=timeout)
+
+    # ---------------- 内部方法 ----------------
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._play_batch(*item)
+
+    def _play_batch(self, hits, submitted_ns):
+        self.latency.record((time.perf_counter_ns() - submitted_ns) / 1e6)
+        for drum_name, velocity, trace_id in hits:
+            try:
+                self.player.play(drum_name, velocity)
+                TRACER.stamp(trace_id, STAGE_MIXER)
+            except Exception as e:
+                self.errors += 1
+                print(f"[ERROR] 播放失败 {drum_name}: {e}")
+        self.batches += 1
+        self.hits += len(hits)
@@ -0,0 +1,100 @@
+import random
+import time
+import drum_aware
+from candidate_index import CandidateIndex
+from drum_aware import DRUM_VOCAB, DrumAwareProb
+
+# ================== 配置 ==================
+PREGEN_WINDOWS_SEC = (10, 60)  # 预生成序列长度
+HITS_PER_SEC = 16  # 预生成序列的击打密度（120BPM 十六分音符 x 2 件鼓）
+NUM_QUERIES = 20000  # 模拟的用户击打次数
+USER_HITS_PER_SEC = 10  # 用户击打频率
+REPEAT = 5
+
+
+class SilentPlayer:
+    """不发声的播放器，避免测量依赖声卡"""
+
+    def play(self, drum_name, velocity=None):
+        pass
+
+
+class StubWorker:
+    """代替生成进程：不加载模型，生成总是失败，DrumAwareProb 保持注入的快照"""
+
+    def generate(self, primer_ticks, primer_pitches, duration_sec, temperature, timeout=None):
+        return None
+
+
+def make_indexes(duration_sec, num_laps):
+    # 每个预生成窗口一份快照，与生成线程按窗口发布的快照相同（绝对 tick_ms）
+    rng = random.Random(0)
+    drum_ids = list(DRUM_VOCAB.values())
+    window_ms = duration_sec * 1000
+    indexes = []
+    for lap in range(num_laps):
+        base_ms = lap * window_ms
+        hits = [(base_ms + rng.randrange(window_ms), rng.choice(drum_ids)) for _ in range(duration_sec * HITS_PER_SEC)]
+        indexes.append(CandidateIndex(hits, covers_until_ms=base_ms + window_ms))
+    return indexes
+
+
+def make_queries():
+    # (绝对秒, 鼓件名)：用户按固定频率击打
+    rng = random.Random(1)
+    drums = list(DRUM_VOCAB)
+    return [(i / USER_HITS_PER_SEC, rng.choice(drums)) for i in range(NUM_QUERIES)]
+
+
+def make_aware(duration_sec):
+    # 低水位设为负无穷、快照时限设为很长，测量期间更新线程不会替换注入的快照
+    return DrumAwareProb(None, generation_worker=StubWorker(), pregen_duration_sec=duration_sec,
+                         update_interval_sec=3600, low_water_ms=float("-inf"), seed=0)
+
+
+def run(duration_sec, indexes, queries, lookup_only):
+    """驱动一个新的 DrumAwareProb 处理全部击打，返回 (耗时秒, 落在快照之外的击打数)"""
+    aware = make_aware(duration_sec)
+    window_ms = duration_sec * 1000
+    lap = 0
+    aware.candidate_index = indexes[0]
+    start = time.perf_counter()
+    for abs_time, drum_name in queries:
+        tick_ms = int(round(abs_time * 1000))
+        if tick_ms >= (lap + 1) * window_ms:
+            # 进入下一个窗口时发布新快照（一次引用赋值，与生成线程相同）
+            lap = tick_ms // window_ms
+            aware.candidate_index = indexes[lap]
+        if lookup_only:
+            aware._choose_hit_prob(drum_name, aware._extract_candidates(tick_ms))
+        else:
+            aware.input_hit(drum_name, abs_time)
+    return time.perf_counter() - start, aware.hits_past_end
+
+
+# 多次运行取最快一次，返回每秒处理的击打数
+def best_rate(duration_sec, indexes, queries, lookup_only):
+    best = None
+    for _ in range(REPEAT):
+        elapsed, past_end = run(duration_sec, indexes, queries, lookup_only)
+        if past_end:
+            print(f"[WARN] {past_end} 次击打落在快照生成区间之外")
+        best = elapsed if best is None else min(best, elapsed)
+    return len(queries) / best
+
+
+def main():
+    drum_aware.DrumPlayer = SilentPlayer
+    queries = make_queries()
+    for duration in PREGEN_WINDOWS_SEC:
+        num_laps = NUM_QUERIES // (duration * USER_HITS_PER_SEC) + 1
+        indexes = make_indexes(duration, num_laps)
+        lookup_rate = best_rate(duration, indexes, queries, lookup_only=True)
+        hit_rate = best_rate(duration, indexes, queries, lookup_only=False)
+        print(f"预生成 {duration} 秒（每个快照 {len(indexes[0])} 个候选）:")
+        print(f"  候选查找 + 选择: {lookup_rate:,.0f} 击打/秒")
+        print(f"  完整 input_hit:  {hit_rate:,.0f} 击打/秒")
+
+
+if __name__ == "__main__":
+    main()
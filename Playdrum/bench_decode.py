@@ -0,0 +1,52 @@
+import os
+import struct
+import time
+import random
+from sensor_connect import PACKET_SIZE, convert_quaternion_and_accel, decode_packets
+
+# ================== 配置 ==================
+NUM_PACKETS = 100000
+REPEAT = 5
+
+
+# 生成随机的Mocopi格式数据包（加速度使用有限值，避免随机字节解析出NaN）
+def make_packets(n):
+    packets = []
+    for _ in range(n):
+        header_and_quat = os.urandom(16)
+        padding = bytes(8)
+        accel = struct.pack('<3e', *(random.uniform(-20.0, 20.0) for _ in range(3)))
+        packets.append(header_and_quat + padding + accel + bytes(PACKET_SIZE - 30))
+    return packets
+
+
+# 多次运行取最快一次，返回每秒处理的包数
+def best_rate(fn, n):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n / best
+
+
+def main():
+    packets = make_packets(NUM_PACKETS)
+    buffer = b"".join(packets)
+
+    def single_path():
+        for p in packets:
+            convert_quaternion_and_accel(p)
+
+    def batch_path():
+        decode_packets(buffer)
+
+    single_rate = best_rate(single_path, NUM_PACKETS)
+    batch_rate = best_rate(batch_path, NUM_PACKETS)
+    print(f"单包解析: {single_rate:,.0f} 包/秒")
+    print(f"批量解析: {batch_rate:,.0f} 包/秒 (x{batch_rate / single_rate:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import tempfile
+from session_log import SessionRecorder, SessionReplayer
+from sensor_connect import SENSOR_MAP, SensorConnector
+from load_generator import DEFAULT_RATE_HZ, DEFAULT_STRIKE_HZ, DEVICE_TICK_HZ, VirtualMotion, encode_packet
+
+# ================== 配置 ==================
+DURATION_SEC = 10.0  # 合成会话时长（1x 回放需要同样长的时间）
+SPEEDS = (1.0, 5.0, 50.0, None)  # None 表示全速
+HOST_START_NS = 10 ** 12  # 合成会话的主机起始时间
+
+
+# 合成一段所有传感器做周期击打的会话日志，返回实际生成的击打数
+def make_session(path):
+    recorder = SessionRecorder(path)
+    motions = [VirtualMotion("periodic", DEFAULT_STRIKE_HZ, seed=i) for i in range(len(SENSOR_MAP))]
+    for k in range(int(DURATION_SEC * DEFAULT_RATE_HZ)):
+        t = k / DEFAULT_RATE_HZ
+        for sensor_id, motion in enumerate(motions):
+            quat, accel = motion.sample(t)
+            data = encode_packet(int(t * DEVICE_TICK_HZ) + 1, quat, accel)
+            recorder.record(sensor_id, HOST_START_NS + int(t * 1e9) + sensor_id * 1000, data)
+    recorder.close()
+    return sum(m.strikes for m in motions)
+
+
+# 以指定倍速回放，只做击打检测，返回 (检测到的击打数, 处理的包数, 溢出丢弃的包数)
+async def replay(path, speed):
+    replayer = SessionReplayer(path, SENSOR_MAP, speed=speed)
+    connector = SensorConnector(client_factory=replayer.client_factory, device_cache_path=None)
+    strikes = []
+    connect_task = asyncio.create_task(connector.connect_all(lambda *args: strikes.append(args), scan=False))
+    await replayer.finished.wait()
+    while any(t.packet_queue for t in connector.trackers):
+        await asyncio.sleep(0.01)
+    connect_task.cancel()
+    return (len(strikes), sum(t.processed for t in connector.trackers),
+            sum(t.dropped for t in connector.trackers))
+
+
+# 检查：任何倍速下检测到的击打数都应与 1x 相同，且没有溢出丢包
+def main():
+    tmp_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp_dir.name, "bench_replay.bin")
+    expected = make_session(path)
+    print(f"合成会话: {DURATION_SEC:.0f}秒，{len(SENSOR_MAP)} 台传感器，{expected} 次击打")
+    baseline = None
+    ok = True
+    for speed in SPEEDS:
+        strikes, processed, dropped = asyncio.run(replay(path, speed))
+        if baseline is None:
+            baseline = strikes
+        match = strikes == baseline and dropped == 0
+        ok = ok and match
+        print(f"速度={'全速' if not speed else f'{speed:g}x'}: 击打 {strikes}，处理 {processed} 包，"
+              f"丢弃 {dropped} 包 {'OK' if match else '与1x不一致'}")
+    tmp_dir.cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import random
+import threading
+import time
+from audio_trigger import AudioTriggerWorker
+
+# ================== 配置 ==================
+NUM_TICKS = 480  # 60秒生成音乐，120BPM 十六分音符（每 125ms 一个刻度）
+MAX_HITS_PER_TICK = 3  # 同一刻度上的最多击打数
+TICK_INTERVAL_SEC = 0.005  # 回放刻度的间隔（加速回放，压力大于实际播放）
+PLAY_COST_SEC = 0.00005  # 模拟 DrumPlayer.play 的耗时（查找声道 + 提交样本）
+DRUMS = ("kick", "snare", "hihat_closed", "crash")
+
+
+class FakePlayer:
+    """只消耗固定时间的播放器，避免测量依赖声卡"""
+
+    def __init__(self):
+        self.played = 0
+        self.lock = threading.Lock()
+
+    def play(self, drum_name, velocity=None):
+        end = time.perf_counter() + PLAY_COST_SEC
+        while time.perf_counter() < end:
+            pass
+        with self.lock:
+            self.played += 1
+
+
+def run(thread_per_hit: bool, ticks):
+    player = FakePlayer()
+    worker = AudioTriggerWorker(player, thread_per_hit=thread_per_hit)
+    start = time.perf_counter()
+    for i, drums in enumerate(ticks):
+        # 与调度线程一样按刻度到期时间提交
+        delay = start + i * TICK_INTERVAL_SEC - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        worker.trigger_batch([(drum, None, None) for drum in drums])
+    total = sum(len(drums) for drums in ticks)
+    while player.played < total:
+        time.sleep(0.001)
+    worker.close()
+    return worker
+
+
+def main():
+    rng = random.Random(0)
+    ticks = [rng.sample(DRUMS, rng.randint(1, MAX_HITS_PER_TICK)) for _ in range(NUM_TICKS)]
+    print(f"{NUM_TICKS} 个刻度，{sum(len(t) for t in ticks)} 次击打")
+    for label, thread_per_hit in (("每次击打新建线程", True), ("常驻触发线程", False)):
+        worker = run(thread_per_hit, ticks)
+        worker.print_stats(label)
+
+
+if __name__ == "__main__":
+    main()
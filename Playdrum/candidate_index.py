@@ -0,0 +1,45 @@
+import bisect
+import time
+import numpy as np
+
+
+class CandidateIndex:
+    """
+    预生成候选击打的只读索引：按时间排序的平行数组（tick_ms 列表, 鼓件id NumPy 数组），
+    用二分查找定位时间窗口，查询为 O(log n)，不产生新的列表。
+    构建完成后不再修改，可作为快照通过一次引用赋值发布给读线程。
+    """
+
+    __slots__ = ("ticks", "drum_ids", "covers_until_ms", "created_at")
+
+    def __init__(self, hits=(), covers_until_ms=None):
+        """
+        :param hits: 可迭代的 (tick_ms, drum_id)，无需预先排序
+        :param covers_until_ms: 生成区间的结束时间，缺省为最后一个候选击打的时间
+        """
+        pairs = sorted(hits)
+        self.ticks = [t for t, _ in pairs]
+        self.drum_ids = np.fromiter((d for _, d in pairs), dtype=np.uint8, count=len(pairs))
+        self.covers_until_ms = covers_until_ms if covers_until_ms is not None else self.end_ms()
+        self.created_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def window(self, start_ms: int, end_ms: int):
+        """返回满足 start_ms < tick <= end_ms 的下标范围 [lo, hi)"""
+        lo = bisect.bisect_right(self.ticks, start_ms)
+        hi = bisect.bisect_right(self.ticks, end_ms, lo)
+        return lo, hi
+
+    def end_ms(self):
+        """最后一个候选击打的时间，空索引返回 None"""
+        return self.ticks[-1] if self.ticks else None
+
+    def covers(self, tick_ms: int) -> bool:
+        """tick_ms 是否仍落在快照的生成区间内"""
+        return self.covers_until_ms is not None and tick_ms <= self.covers_until_ms
+
+    def age(self):
+        """快照生成至今的秒数"""
+        return time.monotonic() - self.created_at
@@ -0,0 +1,109 @@
+# ===== 默认参数 =====
+CLOCK_WINDOW = 500  # 回归的等效窗口长度（包），决定遗忘速度
+CLOCK_WARMUP = 20  # 模型可用前需要的最少样本数
+FLOOR_RISE_SEC = 0.002  # 最小时延下包络每秒回升量，适应传输时延的缓慢变化
+RESET_RESIDUAL_SEC = 0.5  # 残差超过该值视为时钟跳变（重连、设备重启），重建模型
+
+
+class DeviceClock:
+    """
+    单个传感器的在线时钟模型。
+    以设备时间（包头计数或包序号）为自变量、主机 monotonic 时间为因变量，
+    做指数遗忘的线性回归，得到设备时钟相对主机时钟的偏移与速率；
+    BLE 连接间隔和事件循环调度只会让包晚到，因此再跟踪残差的下包络，
+    把回归线平移到“最快到达”的那条线上，得到去抖后的主机时间。
+    """
+
+    def __init__(self, window=CLOCK_WINDOW, warmup=CLOCK_WARMUP):
+        self.alpha = 1.0 / window
+        self.warmup = warmup
+        self.reset_count = 0
+        self.consecutive_resets = 0  # 模型上次稳定（完成预热）以来的重置次数
+        self.duplicates = 0  # 设备时间与上一个包相同而忽略的包数
+        self.reset()
+
+    def reset(self):
+        self.origin_ticks = None
+        self.origin_ns = None
+        self.last_ticks = None
+        self.samples = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.var_x = 0.0
+        self.cov_xy = 0.0
+        self.floor = None  # 残差下包络（秒）
+        self.floor_x = 0.0
+        self.jitter = 0.0  # 残差平均绝对偏差（秒）
+
+    def restart(self):
+        """重连或切换设备时间来源时调用：重建模型，不计入重置次数"""
+        self.consecutive_resets = 0
+        self.reset()
+
+    def slope(self):
+        return self.cov_xy / self.var_x if self.var_x > 0 else 0.0
+
+    def _predict(self, x):
+        return self.mean_y + self.slope() * (x - self.mean_x)
+
+    def update(self, device_ticks: int, host_ns: int) -> int:
+        """输入一个包的设备时间与主机到达时间，返回去抖后的主机时间（ns）"""
+        if device_ticks == self.last_ticks:
+            # 重复的通知（设备时间相同）：不更新模型，也不当作时钟跳变
+            self.duplicates += 1
+            if self.floor is None:
+                return host_ns
+            predicted = self._predict(float(device_ticks - self.origin_ticks))
+            return self.origin_ns + int(round((predicted + self.floor) * 1e9))
+        if self.last_ticks is not None and device_ticks < self.last_ticks:
+            # 设备时间未递增：计数回绕、设备重启或包头并非时间，重新建模
+            self.reset_count += 1
+            self.consecutive_resets += 1
+            self.reset()
+        if self.origin_ticks is None:
+            self.origin_ticks = device_ticks
+            self.origin_ns = host_ns
+        self.last_ticks = device_ticks
+        x = float(device_ticks - self.origin_ticks)
+        y = (host_ns - self.origin_ns) / 1e9
+
+        # 指数加权的均值/协方差更新（数值稳定形式）
+        self.samples += 1
+        alpha = max(self.alpha, 1.0 / self.samples)
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += alpha * dx
+        self.mean_y += alpha * dy
+        self.var_x = (1 - alpha) * (self.var_x + alpha * dx * dx)
+        self.cov_xy = (1 - alpha) * (self.cov_xy + alpha * dx * dy)
+        if self.samples < self.warmup:
+            return host_ns
+        if self.samples == self.warmup:
+            self.consecutive_resets = 0  # 重新完成预热，之前的跳变只是偶发
+
+        predicted = self._predict(x)
+        residual = y - predicted
+        if abs(residual) > RESET_RESIDUAL_SEC:
+            self.reset_count += 1
+            self.consecutive_resets += 1
+            self.reset()
+            return host_ns
+        self.jitter += self.alpha * (abs(residual) - self.jitter)
+
+        # 残差下包络：新低立即跟随，否则按设备时间缓慢回升
+        if self.floor is None or residual < self.floor:
+            self.floor = residual
+        else:
+            elapsed = (x - self.floor_x) * self.slope()
+            self.floor = min(residual, self.floor + FLOOR_RISE_SEC * max(elapsed, 0.0))
+        self.floor_x = x
+        return self.origin_ns + int(round((predicted + self.floor) * 1e9))
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "resets": self.reset_count,
+            "duplicates": self.duplicates,
+            "sec_per_tick": self.slope(),
+            "jitter_ms": self.jitter * 1000,
+        }
@@ -0,0 +1,124 @@
+import array
+import collections
+import threading
+import numpy as np
+
+# ===== 默认参数 =====
+CACHE_STEP_MS = 125  # 量化网格：Drums RNN 的一步（120BPM 十六分音符），演奏抖动在一步之内时得到相同的键
+CACHE_KEY_BARS = 2  # 参与键计算的最近小节数
+STEPS_PER_BAR = 16
+CANDIDATES_PER_KEY = 3  # 每个键缓存的续写条数，命中时轮流返回，保留温度采样带来的变化
+CACHE_MAX_ENTRIES = 256  # 最多缓存的键数
+CACHE_MAX_BYTES = 4 * 1024 * 1024  # 续写数组的内存预算
+ENTRY_OVERHEAD_BYTES = 128  # 每条续写的固定开销估计
+
+# 一条缓存的续写：ticks 为相对锚点（引子最后一次击打）的毫秒偏移，drum_ids 为鼓件id，
+# extra 为调用方附带的数据（如生成区间的结束偏移），generation_ms 为当初生成的耗时
+Continuation = collections.namedtuple("Continuation", ["ticks", "drum_ids", "extra", "generation_ms"])
+
+
+def pattern_key(ticks, drum_ids, step_ms=CACHE_STEP_MS, bars=CACHE_KEY_BARS):
+    """
+    把最近的击打规范化为节奏型键：以最后一次击打为锚点，取最近 bars 小节内的击打，
+    量化为 (相对步数, 鼓件id) 的有序元组。返回 (锚点tick_ms, 键)，没有击打时返回 (None, None)
+    :param ticks: 按写入顺序排列的 tick_ms 数组
+    :param drum_ids: 对应的鼓件id数组
+    """
+    if len(ticks) == 0:
+        return None, None
+    ticks = np.asarray(ticks, dtype=np.int64)
+    anchor = int(ticks[-1])
+    recent = anchor - ticks < bars * STEPS_PER_BAR * step_ms
+    steps = np.rint((ticks[recent] - anchor) / step_ms).astype(np.int64)
+    return anchor, tuple(sorted(set(zip(steps.tolist(), np.asarray(drum_ids)[recent].tolist()))))
+
+
+class ContinuationCache:
+    """
+    Drums RNN 续写的 LRU 缓存：键为量化后的节奏型，每个键保存最多 candidates_per_key 条续写。
+    条数未满时视为未命中（调用方生成并写入），满了之后命中并轮流返回各条续写。
+    按键数与内存预算从最久未使用的键开始淘汰。
+    """
+
+    def __init__(self, candidates_per_key=CANDIDATES_PER_KEY, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES):
+        """
+        :param candidates_per_key: 每个键缓存的续写条数
+        :param max_entries: 最多缓存的键数
+        :param max_bytes: 续写数组占用的内存上限（字节）
+        """
+        self.candidates_per_key = candidates_per_key
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # 键 -> [续写列表, 下一个返回的下标]
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.saved_ms = 0.0  # 命中所节省的生成时间（按当初生成耗时累计）
+
+    @staticmethod
+    def _size_of(continuation):
+        return (continuation.ticks.itemsize * len(continuation.ticks)
+                + continuation.drum_ids.itemsize * len(continuation.drum_ids) + ENTRY_OVERHEAD_BYTES)
+
+    def lookup(self, key):
+        """命中时返回一条 Continuation（轮流返回），否则返回 None"""
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None or len(entry[0]) < self.candidates_per_key:
+                return None
+            self._entries.move_to_end(key)
+            candidates, cursor = entry
+            entry[1] = (cursor + 1) % len(candidates)
+            continuation = candidates[cursor]
+            self.hits += 1
+            self.saved_ms += continuation.generation_ms
+            return continuation
+
+    def store(self, key, hits, extra=None, generation_ms=0.0):
+        """
+        写入一条新生成的续写
+        :param hits: 可迭代的 (相对锚点的 tick_ms, 鼓件id)
+        """
+        ticks = array.array('i')
+        drum_ids = array.array('B')
+        for t_ms, drum_id in hits:
+            ticks.append(t_ms)
+            drum_ids.append(drum_id)
+        continuation = Continuation(ticks, drum_ids, extra, generation_ms)
+        size = self._size_of(continuation)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [[], 0]
+            elif len(entry[0]) >= self.candidates_per_key:
+                self.bytes_used -= self._size_of(entry[0].pop(0))
+            entry[0].append(continuation)
+            self._entries.move_to_end(key)
+            self.bytes_used += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes_used > self.max_bytes):
+                _, (candidates, _) = self._entries.popitem(last=False)
+                self.bytes_used -= sum(self._size_of(c) for c in candidates)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes_used,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "evictions": self.evictions,
+            "saved_ms": self.saved_ms,
+        }
+
+    def print_stats(self, label: str):
+        stats = self.stats()
+        print(f"[{label}] 续写缓存 命中率={stats['hit_rate'] * 100:.1f}% ({stats['hits']}/{stats['lookups']}) "
+              f"键数={stats['entries']} 内存={stats['bytes'] / 1024:.0f}KB 淘汰={stats['evictions']} "
+              f"节省生成时间={stats['saved_ms']:.0f}ms")
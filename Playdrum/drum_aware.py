@@ -1,10 +1,15 @@
 import time
+import numpy as np
+import collections
 import torch
-import random
 from note_seq.protobuf import music_pb2, generator_pb2
-from magenta.models.drums_rnn import drums_rnn_sequence_generator
-from magenta.models.shared import sequence_generator_bundle
 from drum_player import DrumPlayer
+from candidate_index import CandidateIndex
+from hit_store import HitStore, SOURCE_CORRECTED, SOURCE_USER, arrays_to_note_sequence, midi_lookup
+from model_registry import get_generator
+from drum_rnn_stepper import DrumRnnStepper, NextHitScorer
+from streaming_generator import StreamingDrumGenerator
+from continuation_cache import ContinuationCache, pattern_key
 import threading  # 新增：用于异步更新
 import queue  # 新增：用于线程间通信
 
@@ -38,6 +43,23 @@ DRUM_TO_MIDI = {
     "cowbell": 56
 }
 MIDI_TO_DRUM = {v: k for k, v in DRUM_TO_MIDI.items()}
+DRUM_ID_TO_MIDI = midi_lookup(DRUM_VOCAB, DRUM_TO_MIDI)
+NUM_DRUM_SLOTS = max(DRUM_VOCAB.values()) + 1  # 按鼓件id索引的数组长度（id 9 未使用，权重恒为0）
+
+# 候选选择
+CONTEXT_WINDOW = 4  # 参与重复惩罚的最近击打数
+RECENCY_PENALTY = 0.5  # 最近每出现一次，该鼓件概率乘以该值
+USER_WEIGHT = 0.15  # 用户输入鼓件的额外权重
+HISTORY_SCAN_HITS = 256  # 读取引子时最多扫描的最近击打数（max_history_ms 内不会超过）
+
+# 修正模式
+CORRECTION_PREGEN = "pregen"  # 预生成一段音乐，统计时间窗口内候选鼓件的频率
+CORRECTION_STEP = "step"  # 单步打分：RNN 逐步跟随用户击打，直接使用模型对当前步的预测分布
+
+# 重新生成调度
+LOOKAHEAD_LOW_WATER_MS = 3000  # 候选序列领先当前击打不足该值时触发重新生成
+REGEN_LOW_WATER = "low_water"  # 触发原因：领先量低于低水位
+REGEN_STALE = "stale"  # 触发原因：快照超过 update_interval_sec 且期间有新击打
 
 
 class DrumAwareProb:
@@ -46,13 +68,22 @@ class DrumAwareProb:
     """
 
     def __init__(self, bundle_path, threshold: float = 0.3, device=None, max_history_ms=2000,
-                 pregen_duration_sec=10, update_interval_sec=5):
+                 pregen_duration_sec=10, update_interval_sec=5, generation_worker=None,
+                 correction_mode=CORRECTION_PREGEN, streaming_generation=True,
+                 low_water_ms=LOOKAHEAD_LOW_WATER_MS, continuation_cache=True, seed=None, hit_store=None):
         """
         :param bundle_path: Drums RNN 模型路径
         :param threshold: 用户输入合理性概率阈值
         :param max_history_ms: 最大历史长度（毫秒）
         :param pregen_duration_sec: 预生成序列长度（秒）
-        :param update_interval_sec: 异步更新间隔（秒）
+        :param update_interval_sec: 快照最长使用时间（秒），超过后若有新击打则重新生成
+        :param generation_worker: 可选的 GenerationWorker，提供时在独立进程中生成，本进程不加载模型
+        :param correction_mode: CORRECTION_PREGEN 或 CORRECTION_STEP（单步打分需要在本进程加载模型）
+        :param streaming_generation: 本进程预生成时使用流式生成器（引子只编码一次），False 时每次重建引子调用 generate
+        :param low_water_ms: 候选序列领先当前击打的低水位（毫秒），低于该值时请求重新生成
+        :param continuation_cache: 流式生成时按量化节奏型缓存续写，重复的律动不再调用模型
+        :param seed: 随机种子；固定后相同的候选与输入得到相同的修正结果，便于回放比对
+        :param hit_store: 与其他组件共享的 HitStore，修正后的击打写入其中；缺省时自建
         """
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
         self.threshold = threshold
@@ -60,21 +91,55 @@ class DrumAwareProb:
         self.max_history_ms = max_history_ms
         self.pregen_duration_sec = pregen_duration_sec
         self.update_interval_sec = update_interval_sec
+        self.low_water_ms = low_water_ms
 
-        # 加载 Drums RNN
-        self.bundle = sequence_generator_bundle.read_bundle_file(bundle_path)
-        generator_map = drums_rnn_sequence_generator.get_generator_map()
-        self.generator = generator_map['drum_kit'](checkpoint=None, bundle=self.bundle)
-        self.generator.initialize()
+        # Drums RNN：与同进程其他组件共享同一生成器（使用生成进程时由子进程加载）
+        self.correction_mode = correction_mode
+        self.generation_worker = generation_worker if correction_mode == CORRECTION_PREGEN else None
+        self.generator = get_generator(bundle_path) if self.generation_worker is None else None
 
-        self.history_hits = []
-        self.start_time = None
-        self.pre_generated_hits = []  # 新增：存储预生成候选击打列表（[tick_ms, drum_name]，相对时间）
+        # 击打历史（绝对毫秒 + 鼓件id），引子取最近 max_history_ms 内的击打
+        self.hit_store = hit_store if hit_store is not None else HitStore()
+        # 最近 CONTEXT_WINDOW 次击打 (tick_ms, 鼓件id) 及其按id的计数，只在击打线程中读写
+        self.recent_hits = collections.deque(maxlen=CONTEXT_WINDOW)
+        self.recent_counts = np.zeros(NUM_DRUM_SLOTS)
+        self.rng = np.random.default_rng(seed)
+        self.start_ms = None  # 第一次击打的绝对毫秒，tick_ms 以此为零点
+        # 预生成候选击打快照（绝对 tick_ms + 鼓件id）：生成线程在旁路构建新快照后整体替换引用，读线程无需加锁
+        self.candidate_index = CandidateIndex()
         self.pre_gen_base_time = 0  # 新增：预生成序列的基准时间（ms）
+        self.cache = ContinuationCache() if continuation_cache else None
+
+        # 预生成统计
+        self.generations = 0  # 已发布的快照数
+        self.last_generation_ms = 0.0  # 最近一次生成耗时
+        self.hits_total = 0
+        self.hits_past_end = 0  # 击打落在当前快照生成区间之外的次数
+        self.generation_total_ms = 0.0  # 累计生成耗时
+        self.hits_at_generation = 0  # 最近一次生成时的击打数，用于判断用户是否空闲
+        self.last_regen_check = time.monotonic()  # 最近一次生成或空闲检查的时间
+        self.lookahead_ms = None  # 最近一次击打时候选序列的领先量
+        self.lookahead_min_ms = None
+        self.lookahead_sum_ms = 0
+        self.regen_requested = False  # 已有未处理的重新生成请求时不再重复入队
+        self.regen_requests = 0
+        self.regen_coalesced = 0  # 被合并的重复请求
+        self.regen_skipped_idle = 0  # 用户空闲而跳过的定时更新
 
-        # 线程安全锁和队列
-        self.lock = threading.Lock()  # 新增：保护共享数据
-        self.update_queue = queue.Queue()  # 新增：用于触发更新
+        # 线程间通信
+        self.update_queue = queue.Queue()  # 重新生成请求（触发原因），由更新线程合并处理
+
+        # 单步打分模式不需要预生成
+        self.scorer = None
+        self.last_score = None
+        self.streaming = None
+        if correction_mode == CORRECTION_STEP:
+            self.scorer = NextHitScorer(DrumRnnStepper(self.generator), DRUM_TO_MIDI, threshold)
+            return
+
+        # 流式生成器：保持引子之后的 RNN 状态，每次预生成只需输入新增击打
+        if self.generator is not None and streaming_generation:
+            self.streaming = StreamingDrumGenerator(self.generator, DRUM_TO_MIDI, temperature=1.2, seed=seed)
 
         # 初始化预生成序列
         self._pre_generate_sequence()
@@ -83,44 +148,85 @@ class DrumAwareProb:
         self._start_update_thread()
 
     # ---------------- 外部接口 ----------------
-    def input_hit(self, drum_name: str, abs_time: float):
-        """接收当前击打，返回修正后的击打"""
+    def input_hit(self, drum_name: str, abs_time: float, velocity: int = None):
+        """接收当前击打（可附带1~127的力度），返回修正后的击打"""
         if drum_name not in DRUM_VOCAB:
             return None
-        if self.start_time is None:
-            self.start_time = abs_time
-        tick_ms = int((abs_time - self.start_time) * 1000)
-        # 更新历史并限制长度
-        with self.lock:
-            self.history_hits.append(['drum', tick_ms, drum_name])
-            self.history_hits = [h for h in self.history_hits if tick_ms - h[1] <= self.max_history_ms]
-        # 从预生成序列中提取候选击打
-        candidate_hits = self._extract_candidates(tick_ms)
-        corrected_hit = self._choose_hit_prob(drum_name, candidate_hits)
+        abs_ms = int(round(abs_time * 1000))
+        if self.start_ms is None:
+            self.start_ms = abs_ms
+        tick_ms = abs_ms - self.start_ms
+        if self.scorer is not None:
+            # 单步打分：用模型对当前步的预测分布判断用户鼓件
+            self.last_score = self.scorer.score(drum_name, tick_ms)
+            corrected_hit = self.last_score.drum
+        else:
+            # 从预生成序列中提取候选击打
+            self._push_recent(tick_ms, DRUM_VOCAB[drum_name])
+            candidate_hits = self._extract_candidates(tick_ms)
+            corrected_hit = self._choose_hit_prob(drum_name, candidate_hits)
+            self._replace_recent(DRUM_VOCAB[corrected_hit])
         # 播放最终击打
-        self.drum_player.play(corrected_hit)
+        self.drum_player.play(corrected_hit, velocity)
         # 更新历史（用修正后的击打）
-        with self.lock:
-            self.history_hits[-1] = ['drum', tick_ms, corrected_hit]  # 替换用户输入为修正后
+        self.hit_store.append(abs_ms, DRUM_VOCAB[corrected_hit], velocity,
+                              SOURCE_USER if corrected_hit == drum_name else SOURCE_CORRECTED)
+        if self.streaming is not None:
+            self.streaming.observe(corrected_hit, tick_ms)
         # 触发更新
         return corrected_hit
 
+    def stats(self):
+        if self.scorer is not None:
+            return {
+                "mode": self.correction_mode,
+                "scored": self.scorer.scored,
+                "replaced": self.scorer.replaced,
+                "rnn_steps": self.scorer.stepper.steps_run,
+            }
+        index = self.candidate_index
+        return {
+            "mode": self.correction_mode,
+            "generations": self.generations,
+            "generation_age_sec": index.age(),
+            "last_generation_ms": self.last_generation_ms,
+            "candidates": len(index),
+            "hits": self.hits_total,
+            "hits_past_end": self.hits_past_end,
+            "generation_total_ms": self.generation_total_ms,
+            "regen_requests": self.regen_requests,
+            "regen_coalesced": self.regen_coalesced,
+            "regen_skipped_idle": self.regen_skipped_idle,
+            "lookahead_ms": self.lookahead_ms,
+            "lookahead_min_ms": self.lookahead_min_ms,
+            "lookahead_mean_ms": self.lookahead_sum_ms / self.hits_total if self.hits_total else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        if self.scorer is not None:
+            print(f"[DrumAwareProb] 单步打分={stats['scored']} 替换={stats['replaced']} RNN步数={stats['rnn_steps']}")
+            return
+        print(f"[DrumAwareProb] 快照数={stats['generations']} 快照年龄={stats['generation_age_sec']:.1f}s "
+              f"最近生成耗时={stats['last_generation_ms']:.0f}ms 候选数={stats['candidates']} "
+              f"击打={stats['hits']} 超出快照={stats['hits_past_end']}")
+        if stats['lookahead_ms'] is not None:
+            print(f"[DrumAwareProb] 累计生成耗时={stats['generation_total_ms']:.0f}ms "
+                  f"请求={stats['regen_requests']} 合并={stats['regen_coalesced']} 空闲跳过={stats['regen_skipped_idle']} "
+                  f"领先量 当前={stats['lookahead_ms']}ms 最小={stats['lookahead_min_ms']}ms "
+                  f"平均={stats['lookahead_mean_ms']:.0f}ms")
+        if self.cache is not None:
+            self.cache.print_stats("DrumAwareProb")
+
     # ---------------- 内部方法 ----------------
-    def _hits_to_note_sequence(self, hits):
-        ns = music_pb2.NoteSequence()
-        ns.tempos.add(qpm=120)
-        last_time = 0
-        for _, t_ms, drum_name in hits:
-            t_sec = t_ms / 1000.0
-            note = ns.notes.add()
-            note.instrument = 10
-            note.pitch = DRUM_TO_MIDI[drum_name]
-            note.velocity = 100
-            note.start_time = t_sec
-            note.end_time = t_sec + 0.125
-            last_time = max(last_time, note.end_time)
-        ns.total_time = last_time
-        return ns
+    def _history(self):
+        """最近 max_history_ms 内的击打，返回 (tick_ms 数组, 鼓件id 数组)"""
+        view = self.hit_store.tail(HISTORY_SCAN_HITS)
+        if self.start_ms is None or len(view.timestamps) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        keep = view.timestamps >= view.timestamps[-1] - self.max_history_ms
+        return view.timestamps[keep] - self.start_ms, view.drum_ids[keep]
 
     def _note_sequence_to_hits(self, ns):
         hits = []
@@ -131,12 +237,58 @@ class DrumAwareProb:
         return hits
 
     def _pre_generate_sequence(self):
-        """预生成长序列"""
-        with self.lock:
-            primer_hits = self.history_hits[:]  # 复制历史
-            primer_ns = self._hits_to_note_sequence(primer_hits)
-            base_time_sec = primer_ns.total_time
-            self.pre_gen_base_time = int(base_time_sec * 1000)  # 更新基准时间
+        """预生成长序列，完成后以一次引用赋值发布新快照"""
+        start = time.perf_counter()
+        primer_ticks, primer_ids = self._history()
+        self.hits_at_generation = self.hits_total
+        self.last_regen_check = time.monotonic()
+
+        # 相同节奏型的引子直接复用缓存的续写（偏移相对引子最后一次击打）；
+        # 只缓存流式生成的续写，其他路径的结果依赖完整引子，不能用于另一段历史
+        use_cache = self.cache is not None and self.streaming is not None
+        anchor, key = pattern_key(primer_ticks, primer_ids) if use_cache else (None, None)
+        cached = self.cache.lookup(key) if key is not None else None
+        if cached is not None:
+            base_time_ms = anchor + cached.extra
+            new_hits = [(t_ms + anchor, drum_id) for t_ms, drum_id in zip(cached.ticks, cached.drum_ids)]
+        else:
+            generated = self._generate_hits(primer_ticks, primer_ids)
+            if generated is None:
+                return  # 生成超时或失败，继续使用旧快照
+            base_time_ms, new_hits = generated
+            new_hits = [(t_ms, DRUM_VOCAB[drum]) for t_ms, drum in new_hits]
+            if key is not None:
+                self.cache.store(key, ((t_ms - anchor, drum_id) for t_ms, drum_id in new_hits),
+                                 extra=base_time_ms - anchor, generation_ms=(time.perf_counter() - start) * 1000)
+
+        # 在旁路构建完整快照，再整体替换引用；读线程看到的要么是旧快照，要么是新快照
+        index = CandidateIndex(new_hits, covers_until_ms=base_time_ms + int(self.pregen_duration_sec * 1000))
+        self.pre_gen_base_time = base_time_ms
+        self.candidate_index = index
+        self.generations += 1
+        self.last_generation_ms = (time.perf_counter() - start) * 1000
+        self.generation_total_ms += self.last_generation_ms
+
+    def _generate_hits(self, primer_ticks, primer_ids):
+        """以历史为引子生成，返回 (base_time_ms, [[绝对tick_ms, drum_name], ...])，失败返回 None"""
+        duration_ms = int(self.pregen_duration_sec * 1000)
+        if self.streaming is not None:
+            # 已确认状态已包含全部历史，从最后一次击打之后开始生成
+            base_time_ms = int(primer_ticks[-1]) if len(primer_ticks) else 0
+            return base_time_ms, self.streaming.generate_window(base_time_ms, duration_ms)
+
+        if self.generation_worker is not None:
+            result = self.generation_worker.generate(primer_ticks, DRUM_ID_TO_MIDI[primer_ids],
+                                                     self.pregen_duration_sec, 1.2)
+            if result is None:
+                return None
+            # 返回的 tick 与引子在同一时间轴上（已是绝对时间），其中包含引子本身，只保留续写部分
+            base_time_ms, gen_ticks, gen_pitches, _ = result
+            return base_time_ms, [[t_ms, MIDI_TO_DRUM[p]] for t_ms, p in zip(gen_ticks.tolist(), gen_pitches.tolist())
+                                  if p in MIDI_TO_DRUM and t_ms >= base_time_ms]
+
+        primer_ns = arrays_to_note_sequence(music_pb2, primer_ticks, DRUM_ID_TO_MIDI[primer_ids])
+        base_time_sec = primer_ns.total_time
 
         generator_options = generator_pb2.GeneratorOptions()
         section = generator_options.generate_sections.add()
@@ -145,68 +297,106 @@ class DrumAwareProb:
         generator_options.args['temperature'].float_value = 1.2
 
         generated_ns = self.generator.generate(primer_ns, generator_options)
-        new_hits = self._note_sequence_to_hits(generated_ns)  # [tick_ms_relative, drum_name]，tick_ms从0开始（相对base_time）
-
-        with self.lock:
-            self.pre_generated_hits = [[t_ms + self.pre_gen_base_time, drum] for t_ms, drum in new_hits]  # 转换为绝对时间
+        # generate() 返回引子 + 续写，时间轴与引子相同（已是绝对时间），去掉引子部分
+        base_time_ms = int(base_time_sec * 1000)
+        return base_time_ms, [[t_ms, drum] for t_ms, drum in self._note_sequence_to_hits(generated_ns)
+                              if t_ms >= base_time_ms]
 
     def _extract_candidates(self, current_tick_ms, window_ms=500):
-        """从预生成序列中提取当前时间后的窗口内候选击打"""
-        candidates = []
-        with self.lock:
-            for t_ms, drum in self.pre_generated_hits:
-                if current_tick_ms < t_ms <= current_tick_ms + window_ms:
-                    candidates.append(['drum', t_ms, drum])
-        return candidates
+        """二分查找当前时间后窗口内的候选击打，返回 (快照, lo, hi)，不复制候选"""
+        index = self.candidate_index  # 只读一次引用，之后整个查询都使用同一快照
+        self.hits_total += 1
+        if not index.covers(current_tick_ms):
+            self.hits_past_end += 1
+        self._check_lookahead(index, current_tick_ms)
+        lo, hi = index.window(current_tick_ms, current_tick_ms + window_ms)
+        return index, lo, hi
+
+    def _push_recent(self, tick_ms: int, drum_id: int):
+        """记录一次击打，并移除超出窗口或早于 max_history_ms 的击打（与历史淘汰规则一致）"""
+        if len(self.recent_hits) == CONTEXT_WINDOW:
+            self.recent_counts[self.recent_hits.popleft()[1]] -= 1
+        while self.recent_hits and tick_ms - self.recent_hits[0][0] > self.max_history_ms:
+            self.recent_counts[self.recent_hits.popleft()[1]] -= 1
+        self.recent_hits.append((tick_ms, drum_id))
+        self.recent_counts[drum_id] += 1
+
+    def _replace_recent(self, drum_id: int):
+        """用修正后的鼓件替换最近一次击打"""
+        tick_ms, old_id = self.recent_hits[-1]
+        self.recent_counts[old_id] -= 1
+        self.recent_hits[-1] = (tick_ms, drum_id)
+        self.recent_counts[drum_id] += 1
+
+    def _check_lookahead(self, index, current_tick_ms):
+        """记录候选序列领先当前击打的时间，低于低水位时请求重新生成（同一时刻只保留一个请求）"""
+        if index.covers_until_ms is None:
+            lookahead = -current_tick_ms  # 还没有快照，视为已耗尽
+        else:
+            lookahead = index.covers_until_ms - current_tick_ms
+        self.lookahead_ms = lookahead
+        self.lookahead_sum_ms += lookahead
+        if self.lookahead_min_ms is None or lookahead < self.lookahead_min_ms:
+            self.lookahead_min_ms = lookahead
+        if lookahead < self.low_water_ms and not self.regen_requested:
+            self.regen_requested = True
+            self.regen_requests += 1
+            self.update_queue.put(REGEN_LOW_WATER)
+
+    def _next_regen_reason(self):
+        """等待下一个重新生成请求；快照超过 update_interval_sec 仍无请求时返回 REGEN_STALE"""
+        timeout = max(self.update_interval_sec - (time.monotonic() - self.last_regen_check), 0)
+        try:
+            reason = self.update_queue.get(timeout=timeout)
+        except queue.Empty:
+            reason = REGEN_STALE
+        # 合并排队中的重复请求，只生成一次
+        while True:
+            try:
+                self.update_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.regen_coalesced += 1
+        return reason
 
     def _start_update_thread(self):
-        """启动异步更新线程"""
+        """启动异步更新线程：按播放位置（领先量低水位）触发生成，用户空闲时不做定时更新"""
         def update_loop():
             while True:
-                time.sleep(self.update_interval_sec)
-                self._pre_generate_sequence()
+                reason = self._next_regen_reason()
+                if reason == REGEN_STALE and self.hits_total == self.hits_at_generation:
+                    self.regen_skipped_idle += 1
+                    self.last_regen_check = time.monotonic()  # 空闲时推迟下一次检查
+                    continue
+                try:
+                    self._pre_generate_sequence()
+                finally:
+                    self.regen_requested = False
 
         thread = threading.Thread(target=update_loop, daemon=True)
         thread.start()
 
-    import random
-
-    def _choose_hit_prob(self, user_hit, candidate_hits, context_window=4, user_weight=0.15):
+    def _choose_hit_prob(self, user_hit, candidate_hits, user_weight=USER_WEIGHT):
         """
-        改进版选择击打：
+        改进版选择击打（按鼓件id索引的定长数组上做向量运算）：
         1. 使用候选击打频率作为概率分布
         2. 给用户输入加权
         3. 考虑上下文窗口，避免重复
         """
-        if not candidate_hits:
+        index, lo, hi = candidate_hits
+        if lo >= hi:
             return user_hit
 
-        # 统计候选击打出现次数
-        freq = {}
-        for _, _, drum in candidate_hits:
-            freq[drum] = freq.get(drum, 0) + 1
-
-        total = sum(freq.values())
-        probs = {k: v / total for k, v in freq.items()}
+        # 统计候选击打出现次数，转为频率
+        weights = np.bincount(index.drum_ids[lo:hi], minlength=NUM_DRUM_SLOTS) / (hi - lo)
 
         # 用户输入加权
-        if user_hit in probs:
-            probs[user_hit] += user_weight
-        else:
-            probs[user_hit] = user_weight
-
-        # 上下文限制：避免连续重复
-        with self.lock:
-            recent_hits = [h[2] for h in self.history_hits[-context_window:]]
-        for drum in recent_hits:
-            if drum in probs:
-                probs[drum] *= 0.5  # 降低最近出现鼓件概率
-
-        # 归一化概率
-        s = sum(probs.values())
-        probs = {k: v / s for k, v in probs.items()}
-
-        # 概率采样
-        drums, drum_probs = zip(*probs.items())
-        chosen = random.choices(drums, weights=drum_probs, k=1)[0]
-        return chosen
\ No newline at end of file
+        weights[DRUM_VOCAB[user_hit]] += user_weight
+
+        # 上下文限制：最近每出现一次，概率减半，避免连续重复
+        weights *= RECENCY_PENALTY ** self.recent_counts
+
+        # 概率采样（累积分布上二分查找，无需先归一化）
+        cumulative = np.cumsum(weights)
+        chosen = int(np.searchsorted(cumulative, self.rng.random() * cumulative[-1], side='right'))
+        return ID2DRUM[chosen]
@@ -24,11 +24,13 @@ class DrumPlayer:
         # 跟踪可用声道
         self.channels = [pygame.mixer.Channel(i) for i in range(pygame.mixer.get_num_channels())]
         self.channel_index = 0
-    def play(self, drum_name: str):
+    def play(self, drum_name: str, velocity: int = None):
         if drum_name in self.sounds:
             # 动态分配一个空闲声道
             channel = self._get_free_channel()
             if channel:
+                # 力度（1~127）映射为声道音量
+                channel.set_volume(1.0 if velocity is None else velocity / 127.0)
                 channel.play(self.sounds[drum_name])
             else:
                 print(f"No free channel available for {drum_name}")
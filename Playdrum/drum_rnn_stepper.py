@@ -0,0 +1,172 @@
+import collections
+import copy
+import numpy as np
+
+# ===== 默认参数 =====
+STEP_QPM = 120  # 本项目的 NoteSequence 统一使用 120 BPM
+SCORING_TEMPERATURE = 1.0  # 打分时不缩放 logits，得到模型原始分布
+MAX_CATCHUP_STEPS = 64  # 两次击打间隔超过该步数（120BPM 下 8 秒）时重置 RNN 状态，而不是补跑空步
+NUM_ALTERNATIVES = 3  # 打分结果中保留的候选鼓件数
+FEED_CHUNK_STEPS = 64  # 单次 session.run 最多输入的步数（softmax 输出随 batch x 步数增长）
+
+# 单次击打的打分结果：drum为修正后的鼓件，probability为用户鼓件在“本步有击打”条件下的概率
+HitScore = collections.namedtuple("HitScore", ["drum", "probability", "alternatives", "accepted"])
+
+
+def drum_type_map(encoding, drum_to_midi: dict):
+    """
+    鼓件与 MultiDrumOneHotEncoding 类型位的对应关系：
+    返回 (鼓件名 -> 类型位, 类型位 -> 代表鼓件名)，同一类型按 drum_to_midi 的顺序取第一个鼓件
+    """
+    drum_type = {drum: encoding.encode_event(frozenset([pitch])).bit_length() - 1
+                 for drum, pitch in drum_to_midi.items()}
+    type_drum = {}
+    for drum, t in drum_type.items():
+        type_drum.setdefault(t, drum)
+    return drum_type, type_drum
+
+
+class DrumRnnStepper:
+    """
+    逐步运行 Drums RNN（drum_kit）：直接使用生成器计算图中的 inputs/initial_state/final_state/softmax，
+    保存每一步之后的 RNN 状态，新的事件只需前向计算新增的步数。
+    TensorFlow 会话的 run() 是线程安全的，这里不持有 SharedGenerator 的生成锁，避免被长时间生成阻塞。
+    """
+
+    def __init__(self, shared_generator, temperature=SCORING_TEMPERATURE):
+        """
+        :param shared_generator: model_registry.SharedGenerator
+        :param temperature: softmax 温度
+        """
+        generator = shared_generator.generator
+        model = generator._model
+        self.session = model._session
+        self.encoder_decoder = model._config.encoder_decoder
+        self.steps_per_quarter = generator.steps_per_quarter
+        self.temperature = temperature
+
+        graph = self.session.graph
+        self._inputs = graph.get_collection('inputs')[0]
+        self._initial_state = tuple(graph.get_collection('initial_state'))
+        self._final_state = tuple(graph.get_collection('final_state'))
+        self._softmax = graph.get_collection('softmax')[0]
+        temperature_tensors = graph.get_collection('temperature')
+        self._temperature = temperature_tensors[0] if temperature_tensors else None
+        # 生成图的 batch 维是固定的，单条序列需要复制到整个 batch
+        self.batch_size = int(self._inputs.shape[0])
+        self._zero_state = self.session.run(self._initial_state)
+        self.steps_run = 0  # 累计前向计算的步数
+        self.reset()
+
+    def reset(self):
+        """回到零状态，清空已输入的事件"""
+        self.state = self._zero_state
+        self.events = []
+
+    def fork(self):
+        """复制当前状态得到独立的分支，分支上的前向计算不影响本对象"""
+        branch = copy.copy(self)
+        branch.events = list(self.events)
+        return branch
+
+    def step_ms(self, qpm=STEP_QPM):
+        """一个 RNN 步对应的毫秒数（120BPM、每拍4步时为125ms）"""
+        return 60000.0 / qpm / self.steps_per_quarter
+
+    def feed(self, events):
+        """
+        依次输入若干步事件（每步是 MIDI 音高的 frozenset），每 FEED_CHUNK_STEPS 步一次 session.run，
+        返回最后一步之后下一步的类别分布（num_classes,）
+        """
+        start = len(self.events)
+        self.events.extend(events)
+        for chunk_start in range(start, len(self.events), FEED_CHUNK_STEPS):
+            chunk_end = min(chunk_start + FEED_CHUNK_STEPS, len(self.events))
+            inputs = np.asarray([self.encoder_decoder.events_to_input(self.events, i)
+                                 for i in range(chunk_start, chunk_end)], dtype=np.float32)
+            batch = np.broadcast_to(inputs, (self.batch_size,) + inputs.shape)
+            feed_dict = {self._inputs: batch, self._initial_state: self.state}
+            if self._temperature is not None:
+                feed_dict[self._temperature] = self.temperature
+            self.state, softmax = self.session.run([self._final_state, self._softmax], feed_dict)
+        self.steps_run += len(events)
+        return softmax[0, -1]
+
+
+class NextHitScorer:
+    """
+    单步打分：把用户击打量化到 RNN 步，击打之间的空步一次性补跑，
+    得到当前步的下一事件分布，计算用户鼓件的概率并与 threshold 比较。
+    事件类别是各鼓件类型的位掩码，某类型的边缘概率等于包含该位的类别概率之和；
+    再除以“本步非空”的概率，得到“既然这一步有击打，是该鼓件”的条件概率。
+    """
+
+    def __init__(self, stepper: DrumRnnStepper, drum_to_midi: dict, threshold: float, qpm=STEP_QPM):
+        """
+        :param stepper: DrumRnnStepper
+        :param drum_to_midi: 鼓件名 -> MIDI 音高
+        :param threshold: 用户鼓件条件概率低于该值时替换为概率最高的鼓件
+        """
+        self.stepper = stepper
+        self.drum_to_midi = drum_to_midi
+        self.threshold = threshold
+        self.step_ms = stepper.step_ms(qpm)
+
+        encoding = stepper.encoder_decoder._one_hot_encoding
+        num_classes = self.num_classes = encoding.num_classes
+        num_types = num_classes.bit_length() - 1
+        self.empty_class = encoding.encode_event(frozenset())
+        # 每个鼓件对应的类型位；同一类型的多个鼓件（如 snare/clap/cowbell）共享概率
+        self.drum_type, self.type_drum = drum_type_map(encoding, drum_to_midi)
+        # (类别, 类型) 位矩阵
+        self.class_bits = ((np.arange(num_classes)[:, None] >> np.arange(num_types)) & 1).astype(np.float32)
+
+        self.pending_step = None  # 正在累积击打的步
+        self.pending_pitches = set()
+        self.probs = None  # pending_step 的类别分布
+        self.scored = 0
+        self.replaced = 0
+
+    def _advance(self, step: int):
+        """把 pending_step 之前累积的击打和之后的空步输入 RNN，直到 step"""
+        if self.pending_step is None or step - self.pending_step > MAX_CATCHUP_STEPS:
+            self.stepper.reset()
+            self.pending_step = step
+            self.pending_pitches = set()
+            self.probs = None
+            return
+        if step <= self.pending_step:
+            return  # 同一步内的多次击打（或略晚到的击打）归入当前步
+        events = [frozenset(self.pending_pitches)] + [frozenset()] * (step - self.pending_step - 1)
+        self.probs = self.stepper.feed(events)
+        self.pending_step = step
+        self.pending_pitches = set()
+
+    def score(self, drum_name: str, tick_ms: int) -> HitScore:
+        """对 tick_ms 时刻的用户击打打分，并把（修正后的）击打计入当前步"""
+        self._advance(int(round(tick_ms / self.step_ms)))
+        if self.probs is None or drum_name not in self.drum_type:
+            self._commit(drum_name)
+            return HitScore(drum_name, None, [], True)
+
+        probs = self.probs[:self.num_classes]  # 有回看距离时 softmax 末尾还有“重复”类别，这里不计入
+        hit_mass = max(1.0 - float(probs[self.empty_class]), 1e-9)
+        type_probs = (probs @ self.class_bits) / hit_mass
+        ranked = np.argsort(type_probs)[::-1]
+        alternatives = [(self.type_drum[t], float(type_probs[t])) for t in ranked[:NUM_ALTERNATIVES]
+                        if t in self.type_drum]
+        probability = float(type_probs[self.drum_type[drum_name]])
+
+        self.scored += 1
+        accepted = probability >= self.threshold
+        corrected = drum_name
+        if not accepted and alternatives and self.drum_type[alternatives[0][0]] != self.drum_type[drum_name]:
+            corrected = alternatives[0][0]
+            self.replaced += 1
+        self._commit(corrected)
+        return HitScore(corrected, probability, alternatives, accepted)
+
+    def _commit(self, drum_name: str):
+        pitch = self.drum_to_midi.get(drum_name)
+        if pitch is not None:
+            self.pending_pitches.add(pitch)
@@ -0,0 +1,193 @@
+import collections
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeout
+import numpy as np
+from hit_store import arrays_to_note_sequence
+
+# ===== 默认参数 =====
+GENERATION_TIMEOUT_SEC = 30.0  # 单次生成请求的默认超时
+STARTUP_TIMEOUT_SEC = 120.0  # 等待子进程加载模型的最长时间
+
+
+# ================= 子进程 =================
+def _generate(generator, generator_pb2, music_pb2, payload):
+    ticks, pitches, duration_sec, temperature = payload
+    primer_ns = arrays_to_note_sequence(music_pb2, ticks, pitches)
+    generator_options = generator_pb2.GeneratorOptions()
+    section = generator_options.generate_sections.add()
+    section.start_time = primer_ns.total_time  # 从引子末尾开始生成
+    section.end_time = primer_ns.total_time + duration_sec
+    generator_options.args['temperature'].float_value = temperature
+    generated_ns = generator.generate(primer_ns, generator_options)
+
+    notes = generated_ns.notes
+    out_ticks = np.fromiter((int(round(n.start_time * 1000)) for n in notes), dtype=np.int64, count=len(notes))
+    out_pitches = np.fromiter((n.pitch for n in notes), dtype=np.int16, count=len(notes))
+    end_ms = max((int(round(n.end_time * 1000)) for n in notes), default=0)
+    return int(primer_ns.total_time * 1000), out_ticks, out_pitches, end_ms
+
+
+def _worker_main(bundle_path, conn):
+    """子进程入口：加载一次模型，然后按顺序处理管道中的生成请求"""
+    # 重量级依赖只在子进程中导入
+    from magenta.models.drums_rnn import drums_rnn_sequence_generator
+    from magenta.models.shared import sequence_generator_bundle
+    from note_seq.protobuf import generator_pb2, music_pb2
+
+    bundle = sequence_generator_bundle.read_bundle_file(bundle_path)
+    generator = drums_rnn_sequence_generator.get_generator_map()['drum_kit'](checkpoint=None, bundle=bundle)
+    generator.initialize()
+    conn.send(("ready", None, None))
+
+    pending = collections.deque()
+    while True:
+        # 先读完管道中的全部消息，使开始生成前到达的取消请求生效
+        try:
+            while not pending or conn.poll():
+                message = conn.recv()
+                if message is None:
+                    return
+                kind, request_id, payload = message
+                if kind == "cancel":
+                    pending = collections.deque(p for p in pending if p[0] != request_id)
+                else:
+                    pending.append((request_id, payload))
+        except (EOFError, OSError):
+            return
+        request_id, payload = pending.popleft()
+        try:
+            conn.send(("result", request_id, _generate(generator, generator_pb2, music_pb2, payload)))
+        except Exception as e:
+            conn.send(("error", request_id, str(e)))
+
+
+# ================= 主进程 =================
+class GenerationWorker:
+    """
+    在独立进程中运行 Drums RNN 生成，避免生成与BLE回调、音频触发争抢 GIL 和 CPU。
+    子进程只加载一次模型；请求与结果都是 NumPy 数组，经管道传递。
+    支持取消与超时：超时的请求会被取消，子进程若尚未开始处理则直接跳过，已在生成的结果到达后丢弃。
+    """
+
+    def __init__(self, bundle_path: str, timeout=GENERATION_TIMEOUT_SEC):
+        """
+        :param bundle_path: Drums RNN 模型路径
+        :param timeout: 默认的单次生成超时（秒）
+        """
+        self.bundle_path = bundle_path
+        self.timeout = timeout
+        self.completed = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._ids = itertools.count()
+        self._futures = {}
+        self._lock = threading.Lock()  # 保护 _futures 与管道发送端
+        self.ready = threading.Event()
+        # Linux 下用 fork 启动，子进程无需重新导入主脚本；须在加载模型和音频之前创建
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self._start()
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        self.process = self._context.Process(target=_worker_main, args=(self.bundle_path, child_conn),
+                                             name="drum-generation", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self._receiver = threading.Thread(target=self._receive_loop, args=(parent_conn,),
+                                          name="drum-generation-receiver", daemon=True)
+        self._receiver.start()
+
+    def _receive_loop(self, conn):
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                self.ready.set()
+                continue
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is None:
+                continue  # 已取消或已超时
+            if kind == "result":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+        # 子进程退出：未完成的请求全部失败
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.set_exception(RuntimeError("生成进程已退出"))
+
+    # ---------------- 外部接口 ----------------
+    def submit(self, primer_ticks, primer_pitches, duration_sec: float, temperature: float):
+        """提交生成请求，返回 (request_id, Future)；Future 结果为 (引子结束ms, tick_ms数组, 音高数组, 结束ms)"""
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._futures[request_id] = future
+            self.conn.send(("generate", request_id, (primer_ticks, primer_pitches, duration_sec, temperature)))
+        return request_id, future
+
+    def cancel(self, request_id: int) -> bool:
+        """取消请求；已完成或不存在的请求返回 False"""
+        with self._lock:
+            future = self._futures.pop(request_id, None)
+            if future is None:
+                return False
+            self.conn.send(("cancel", request_id, None))
+        future.cancel()
+        self.cancelled += 1
+        return True
+
+    def generate(self, primer_ticks, primer_pitches, duration_sec: float, temperature: float, timeout=None):
+        """阻塞等待生成结果，超时、取消或失败时返回 None"""
+        if not self.ready.wait(STARTUP_TIMEOUT_SEC):
+            print("[ERROR] 生成进程未能在限定时间内加载模型")
+            return None
+        request_id, future = self.submit(primer_ticks, primer_pitches, duration_sec, temperature)
+        try:
+            result = future.result(timeout if timeout is not None else self.timeout)
+        except FutureTimeout:
+            self.cancel(request_id)
+            self.timeouts += 1
+            print(f"[WARN] 生成请求 {request_id} 超时，已取消")
+            return None
+        except CancelledError:
+            return None
+        except Exception as e:
+            self.errors += 1
+            print(f"[ERROR] 生成请求 {request_id} 失败: {e}")
+            return None
+        self.completed += 1
+        return result
+
+    def stats(self):
+        return {
+            "alive": self.process.is_alive(),
+            "pending": len(self._futures),
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout=1.0):
+        """通知子进程退出，超时未退出则强制结束"""
+        try:
+            with self._lock:
+                self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
@@ -0,0 +1,115 @@
+import collections
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# ===== 默认参数 =====
+HIT_QUEUE_SIZE = 256  # 击打事件队列容量
+STATS_SAMPLES = 1024  # 每个阶段保留的最近耗时样本数
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class HitPipeline:
+    """
+    分级击打处理管线：
+    BLE阶段（事件循环内）只给击打事件打时间戳并入队，立即返回；
+    工作阶段（独立线程）依次完成修正、调度与播放。
+    记录队列深度、排队时间以及各阶段耗时，便于定位延迟累积的位置。
+    """
+
+    def __init__(self, handler, maxsize=HIT_QUEUE_SIZE, name="hit-worker"):
+        """
+        :param handler: 工作线程中执行的处理函数，参数与传感器回调一致
+        :param maxsize: 队列容量，满时丢弃新事件而不是阻塞事件循环
+        """
+        self.handler = handler
+        self.queue = queue.Queue(maxsize)
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.stage_ms = collections.defaultdict(lambda: collections.deque(maxlen=STATS_SAMPLES))
+        self.stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------------- BLE阶段 ----------------
+    def submit(self, *args, **kwargs):
+        """传感器回调：只入队，不做任何处理"""
+        start_ns = time.perf_counter_ns()
+        try:
+            self.queue.put_nowait((start_ns, args, kwargs))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        self._record("ble", (time.perf_counter_ns() - start_ns) / 1e6)
+
+    # ---------------- 工作阶段 ----------------
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            enqueued_ns, args, kwargs = item
+            start_ns = time.perf_counter_ns()
+            self._record("queue_wait", (start_ns - enqueued_ns) / 1e6)
+            try:
+                self.handler(*args, **kwargs)
+            except Exception as e:
+                print(f"[ERROR] 击打处理失败: {e}")
+            finally:
+                self._record("worker", (time.perf_counter_ns() - start_ns) / 1e6)
+                self.processed += 1
+                self.queue.task_done()
+
+    @contextmanager
+    def stage(self, name: str):
+        """在处理函数内部统计子阶段耗时：with pipeline.stage("correction"): ..."""
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._record(name, (time.perf_counter_ns() - start_ns) / 1e6)
+
+    def _record(self, name: str, ms: float):
+        with self.stats_lock:
+            self.stage_ms[name].append(ms)
+
+    # ---------------- 统计与控制 ----------------
+    def stats(self):
+        with self.stats_lock:
+            samples = {name: sorted(values) for name, values in self.stage_ms.items()}
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "stages": {name: {"p50": percentile(v, 50), "p95": percentile(v, 95), "max": v[-1] if v else 0.0}
+                       for name, v in samples.items()},
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"[HitPipeline] 队列深度={stats['depth']} 最大深度={stats['max_depth']} "
+              f"提交={stats['submitted']} 丢弃={stats['dropped']} 已处理={stats['processed']}")
+        for name, s in stats["stages"].items():
+            print(f"  {name}: p50={s['p50']:.3f}ms p95={s['p95']:.3f}ms max={s['max']:.3f}ms")
+
+    def wait_idle(self):
+        """阻塞直到队列中的事件全部处理完"""
+        self.queue.join()
+
+    def stop(self, timeout=1.0):
+        self.queue.put(None)
+        self._thread.join(timeout=timeout)
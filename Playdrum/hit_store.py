@@ -0,0 +1,123 @@
+import collections
+import numpy as np
+
+# ===== 默认参数 =====
+HIT_STORE_CAPACITY = 65536  # 环形缓冲区容量（击打数），四列共约 720KB
+SOURCE_USER = 0  # 用户原始击打
+SOURCE_CORRECTED = 1  # 被 DrumAwareProb 替换过鼓件的击打
+DEFAULT_VELOCITY = 100  # 没有力度信息（记为0）时导出使用的力度
+NOTE_DURATION_SEC = 0.125  # 16分音符
+DRUM_INSTRUMENT = 10  # 鼓组通道
+DEFAULT_PITCH = 36  # 未知鼓件id对应的 MIDI 音高
+
+# 一段击打的快照（各列为独立拷贝，按写入顺序排列）：timestamps 为绝对毫秒，drum_ids 为 DRUM_VOCAB 中的id
+HitView = collections.namedtuple("HitView", ["timestamps", "drum_ids", "velocities", "sources"])
+
+
+def midi_lookup(drum_vocab: dict, drum_to_midi: dict) -> np.ndarray:
+    """按鼓件id索引的 MIDI 音高数组，用于把 drum_ids 列一次性转换为音高"""
+    lookup = np.full(max(drum_vocab.values()) + 1, DEFAULT_PITCH, dtype=np.int16)
+    for drum, drum_id in drum_vocab.items():
+        lookup[drum_id] = drum_to_midi.get(drum, DEFAULT_PITCH)
+    return lookup
+
+
+def arrays_to_note_sequence(music_pb2, ticks_ms, pitches, velocities=None, qpm=120):
+    """
+    (tick_ms, 音高[, 力度]) 数组转换为 NoteSequence：排序与时间换算一次完成，之后只逐个填写音符
+    :param velocities: 可选的力度数组，0 或缺省时使用 DEFAULT_VELOCITY
+    """
+    ticks_ms = np.asarray(ticks_ms)
+    order = np.argsort(ticks_ms, kind='stable')
+    starts = ticks_ms[order] / 1000.0
+    ends = starts + NOTE_DURATION_SEC
+    pitches = np.asarray(pitches)[order]
+    if velocities is None:
+        velocities = np.full(len(order), DEFAULT_VELOCITY)
+    else:
+        velocities = np.asarray(velocities)[order]
+        velocities = np.where(velocities > 0, velocities, DEFAULT_VELOCITY)
+
+    ns = music_pb2.NoteSequence()
+    ns.tempos.add(qpm=qpm)
+    for start, end, pitch, velocity in zip(starts.tolist(), ends.tolist(), pitches.tolist(), velocities.tolist()):
+        note = ns.notes.add()
+        note.instrument = DRUM_INSTRUMENT
+        note.pitch = pitch
+        note.velocity = velocity
+        note.start_time = start
+        note.end_time = end
+    ns.total_time = float(ends[-1]) if len(ends) else 0
+    return ns
+
+
+class HitStore:
+    """
+    击打历史的列式环形缓冲区（时间戳 int64、鼓件id uint8、力度 uint8、来源 uint8），
+    由各组件共享，取代各自维护、各自裁剪的击打列表。
+    单写者：写入不加锁，先递增 _begun 再写各列，写完后发布 count；
+    读者按 seqlock 方式复制所需区间，复制后检查写者是否已开始覆盖该区间，被覆盖则重试，
+    因此读到的总是一致的快照。多个线程写入时需由调用方串行化（本项目的击打都在同一个工作线程中写入）。
+    """
+
+    def __init__(self, capacity=HIT_STORE_CAPACITY):
+        """
+        :param capacity: 最多保留的击打数，写满后覆盖最旧的击打
+        """
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.drum_ids = np.zeros(capacity, dtype=np.uint8)
+        self.velocities = np.zeros(capacity, dtype=np.uint8)
+        self.sources = np.zeros(capacity, dtype=np.uint8)
+        self._begun = 0  # 已开始写入的击打数
+        self.count = 0  # 已完成写入的击打数（累计，不受容量限制）
+        self.retries = 0  # 读者因覆盖而重试的次数
+
+    def __len__(self):
+        """当前保留的击打数"""
+        return min(self.count, self.capacity)
+
+    # ---------------- 写入 ----------------
+    def append(self, timestamp_ms: int, drum_id: int, velocity=None, source=SOURCE_USER):
+        """追加一次击打（单写者，不加锁）"""
+        seq = self._begun
+        self._begun = seq + 1
+        slot = seq % self.capacity
+        self.timestamps[slot] = timestamp_ms
+        self.drum_ids[slot] = drum_id
+        self.velocities[slot] = velocity or 0
+        self.sources[slot] = source
+        self.count = seq + 1
+
+    # ---------------- 读取 ----------------
+    def tail(self, n=None) -> HitView:
+        """最近 n 次击打的一致快照（n 为 None 时返回全部保留的击打）"""
+        while True:
+            end = self.count
+            start = max(end - self.capacity, 0) if n is None else max(end - min(n, self.capacity), 0)
+            slots = np.arange(start, end) % self.capacity
+            view = HitView(self.timestamps[slots], self.drum_ids[slots], self.velocities[slots], self.sources[slots])
+            # 复制期间写者若已开始覆盖 [start, end) 中的槽位，则快照可能不一致
+            if self._begun <= start + self.capacity:
+                return view
+            self.retries += 1
+
+    # ---------------- 导出 ----------------
+    def to_note_sequence(self, music_pb2, id_to_midi: np.ndarray, origin_ms=None, n=None):
+        """
+        把保留的击打导出为 NoteSequence
+        :param id_to_midi: midi_lookup() 得到的音高数组
+        :param origin_ms: 时间零点（绝对毫秒），缺省为第一次击打
+        """
+        view = self.tail(n)
+        if origin_ms is None:
+            origin_ms = int(view.timestamps.min()) if len(view.timestamps) else 0
+        return arrays_to_note_sequence(music_pb2, view.timestamps - origin_ms, id_to_midi[view.drum_ids],
+                                       view.velocities)
+
+    def save_midi(self, path: str, id_to_midi: np.ndarray, origin_ms=None):
+        """把保留的击打导出为 MIDI 文件"""
+        import note_seq
+        from note_seq.protobuf import music_pb2
+        note_seq.sequence_proto_to_midi_file(self.to_note_sequence(music_pb2, id_to_midi, origin_ms), path)
+        print(f"[HitStore] 已导出 {len(self)} 次击打到 {path}")
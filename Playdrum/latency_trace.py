@@ -0,0 +1,142 @@
+import bisect
+import itertools
+import json
+import time
+import numpy as np
+
+# ===== 追踪阶段（按击打在管线中经过的顺序） =====
+STAGE_ARRIVAL = 0  # 数据包到达（入队时刻）
+STAGE_STRIKE = 1  # 击打检测完成，调用传感器回调
+STAGE_WORKER = 2  # 工作线程开始处理
+STAGE_CORRECTED = 3  # DrumAwareProb.input_hit 返回
+STAGE_CONTINUATOR = 4  # MusicContinuator.input_a_hit 返回
+STAGE_DISPATCH = 5  # _safe_play 提交给播放触发线程
+STAGE_MIXER = 6  # DrumPlayer.play 把样本交给 pygame 声道
+STAGE_NAMES = ("arrival", "strike", "worker", "corrected", "continuator", "dispatch", "mixer")
+
+TRACE_CAPACITY = 4096  # 环形缓冲区可保存的击打数
+HISTOGRAM_BOUNDS_MS = (0.5, 1, 2, 5, 10, 16, 50)  # 延迟直方图的桶上界（16ms 为一个播放刻度）
+
+# perf_counter_ns 与 monotonic_ns 的差值，用于换算包到达时间
+_PERF_OFFSET_NS = time.perf_counter_ns() - time.monotonic_ns()
+
+
+class LatencyHistogram:
+    """定长桶的延迟直方图（毫秒），记录为 O(log 桶数)，可在任意线程中调用"""
+
+    def __init__(self, bounds_ms=HISTOGRAM_BOUNDS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.bounds_ms, value_ms)] += 1
+        self.total += 1
+        self.sum_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def summary(self):
+        labels = [f"<={b}ms" for b in self.bounds_ms] + [f">{self.bounds_ms[-1]}ms"]
+        return {
+            "count": self.total,
+            "mean_ms": self.sum_ms / self.total if self.total else 0.0,
+            "max_ms": self.max_ms,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+    def print_summary(self, title: str):
+        stats = self.summary()
+        buckets = " ".join(f"{label}:{count}" for label, count in stats["buckets"].items())
+        print(f"{title} 次数={stats['count']} 平均={stats['mean_ms']:.2f}ms 最大={stats['max_ms']:.2f}ms | {buckets}")
+
+
+class HitTracer:
+    """
+    逐击打延迟追踪：每次击打占环形缓冲区的一行，各阶段写入 perf_counter_ns 时间戳。
+    未启用时 begin() 返回 None，stamp(None, ...) 直接返回，开销可以忽略。
+    """
+
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.enabled = False
+        self.capacity = capacity
+        self.stamps = np.zeros((capacity, len(STAGE_NAMES)), dtype=np.int64)
+        self.sensor_ids = np.zeros(capacity, dtype=np.int16)
+        self._ids = itertools.count()
+        self.count = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def begin(self, sensor_id: int, arrival_monotonic_ns: int):
+        """为一次击打分配追踪行，记录到达与检测时刻，返回 trace_id"""
+        if not self.enabled:
+            return None
+        trace_id = next(self._ids)
+        row = trace_id % self.capacity
+        self.stamps[row] = 0
+        self.stamps[row, STAGE_ARRIVAL] = arrival_monotonic_ns + _PERF_OFFSET_NS
+        self.stamps[row, STAGE_STRIKE] = time.perf_counter_ns()
+        self.sensor_ids[row] = sensor_id
+        self.count = trace_id + 1
+        return trace_id
+
+    def stamp(self, trace_id, stage: int):
+        if trace_id is None:
+            return
+        self.stamps[trace_id % self.capacity, stage] = time.perf_counter_ns()
+
+    def _filled_rows(self):
+        return self.stamps[:min(self.count, self.capacity)]
+
+    def summary(self):
+        """各阶段相对包到达的延迟 p50/p95/p99（ms）"""
+        rows = self._filled_rows()
+        result = {}
+        for stage in range(1, len(STAGE_NAMES)):
+            valid = rows[:, stage] > 0
+            if not valid.any():
+                continue
+            delays = (rows[valid, stage] - rows[valid, STAGE_ARRIVAL]) / 1e6
+            p50, p95, p99 = np.percentile(delays, [50, 95, 99])
+            result[STAGE_NAMES[stage]] = {"count": int(valid.sum()), "p50": p50, "p95": p95, "p99": p99}
+        return result
+
+    def print_summary(self):
+        print(f"===== 击打延迟（相对包到达，共 {self.count} 次击打） =====")
+        for name, s in self.summary().items():
+            print(f"{name:>12}: n={s['count']} p50={s['p50']:.2f}ms p95={s['p95']:.2f}ms p99={s['p99']:.2f}ms")
+
+    def export_chrome_trace(self, path: str):
+        """导出 Chrome trace JSON（chrome://tracing / Perfetto 可直接打开），每个传感器一条轨道"""
+        rows = self._filled_rows()
+        base = rows[rows > 0].min() if rows.any() else 0
+        events = []
+        for row, sensor_id in zip(rows, self.sensor_ids):
+            stages = [i for i in range(len(STAGE_NAMES)) if row[i] > 0]
+            for a, b in zip(stages, stages[1:]):
+                events.append({
+                    "name": f"{STAGE_NAMES[a]}->{STAGE_NAMES[b]}",
+                    "ph": "X",
+                    "pid": 1,
+                    "tid": int(sensor_id),
+                    "ts": (row[a] - base) / 1000.0,
+                    "dur": (row[b] - row[a]) / 1000.0,
+                })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"已导出 {len(events)} 个追踪事件到 {path}")
+
+    def shutdown(self, path=None):
+        """退出时调用：输出延迟统计，并在给定路径时导出 Chrome trace"""
+        if not self.enabled or self.count == 0:
+            return
+        self.print_summary()
+        if path:
+            self.export_chrome_trace(path)
+
+
+# 进程内共享的追踪器
+TRACER = HitTracer()
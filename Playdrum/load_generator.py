@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import importlib
+import math
+import random
+import struct
+import time
+import numpy as np
+from sensor_connect import QUAT_MATRIX, SENSOR_MAP, WALL_CLOCK_OFFSET, SensorConnector
+from hit_pipeline import percentile
+from onset_detector import WARMUP_SEC
+
+# ================== 配置 ==================
+DEFAULT_SENSOR_COUNTS = (6, 12, 24, 48)
+DEFAULT_RATE_HZ = 100.0  # 每台虚拟传感器的发包频率
+DEFAULT_DURATION_SEC = 5.0
+DEFAULT_STRIKE_HZ = 4.0  # 每台传感器的击打频率
+PROFILES = ("periodic", "random", "idle")
+GRAVITY = 9.8
+NOISE_STD = 0.05  # 加速度噪声（与加速度单位一致）
+STRIKE_WIDTH_SEC = 0.03  # 单次击打的加速度脉冲宽度
+STRIKE_AMPLITUDE = (2.0, 6.0)  # 击打脉冲幅度范围
+DEVICE_TICK_HZ = 1_000_000  # 虚拟设备时钟频率（写入包头）
+
+_PACKET_STRUCT = struct.Struct('<Q4h8x3e')
+_QUAT_MATRIX_INV = np.linalg.inv(np.array(QUAT_MATRIX, dtype=np.float64))
+
+
+# 按 convert_quaternion_and_accel 的字节布局构造一个Mocopi数据包（解析的逆过程）
+def encode_packet(device_ticks: int, quat, accel) -> bytes:
+    raw = _QUAT_MATRIX_INV @ np.asarray(quat, dtype=np.float64)
+    qw, qx, qy, qz = (int(max(-32768, min(32767, round(v)))) for v in raw)
+    return _PACKET_STRUCT.pack(device_ticks, qw, qx, qy, qz, *accel)
+
+
+# 单台虚拟传感器的运动模型：缓慢转动的姿态 + 重力 + 噪声 + 击打脉冲
+class VirtualMotion:
+    def __init__(self, profile: str, strike_hz: float, seed=None):
+        self.profile = profile
+        self.strike_hz = strike_hz
+        self.rng = random.Random(seed)
+        self.phase = self.rng.random()
+        self.next_strike = self._next_strike_time(WARMUP_SEC)  # 检测器预热期间不产生击打
+        self.strike_start = None
+        self.strike_amplitude = 0.0
+        self.strikes = 0  # 已生成的击打数
+
+    def _next_strike_time(self, t):
+        if self.profile == "idle" or self.strike_hz <= 0:
+            return math.inf
+        if self.profile == "random":
+            return t + self.rng.expovariate(self.strike_hz)
+        period = 1.0 / self.strike_hz
+        return (math.floor(t / period + self.phase) + 1 - self.phase) * period
+
+    def sample(self, t: float):
+        angle = 0.3 * math.sin(2 * math.pi * 0.2 * t + self.phase)
+        quat = (math.cos(angle / 2), 0.0, 0.0, math.sin(angle / 2))
+        magnitude = GRAVITY + self.rng.gauss(0.0, NOISE_STD)
+        if t >= self.next_strike:
+            self.strike_start = self.next_strike
+            self.strike_amplitude = self.rng.uniform(*STRIKE_AMPLITUDE)
+            self.next_strike = self._next_strike_time(t)
+            self.strikes += 1
+        if self.strike_start is not None:
+            phase = (t - self.strike_start) / STRIKE_WIDTH_SEC
+            if phase < 1.0:
+                magnitude += self.strike_amplitude * math.sin(math.pi * phase)
+            else:
+                self.strike_start = None
+        return quat, (0.0, 0.0, magnitude)
+
+
+# 虚拟传感器群：为每台 SingleTracker 按固定频率构造数据包，走真实的入队/消费/检测/回调路径
+class VirtualFleet:
+    def __init__(self, num_sensors: int, rate_hz=DEFAULT_RATE_HZ, profile="periodic",
+                 strike_hz=DEFAULT_STRIKE_HZ, seed=0):
+        self.rate_hz = rate_hz
+        self.sensor_map = {f"VIRTUAL_{i}": f"02:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(num_sensors)}
+        self.connector = SensorConnector(sensor_map=self.sensor_map, device_cache_path=None)
+        self.motions = [VirtualMotion(profile, strike_hz, seed=seed + i) for i in range(num_sensors)]
+        self.packets_sent = 0
+
+    async def _stream(self, tracker, motion, start: float, duration: float):
+        period = 1.0 / self.rate_hz
+        k = 0
+        offset = motion.phase * period  # 错开各传感器的发包时刻
+        while True:
+            t = k * period + offset
+            if t >= duration:
+                return
+            delay = start + t - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            quat, accel = motion.sample(t)
+            tracker.push_packet(encode_packet(int(t * DEVICE_TICK_HZ) + 1, quat, accel))
+            self.packets_sent += 1
+            k += 1
+
+    async def run(self, callback, duration: float):
+        for tracker in self.connector.trackers:
+            self.connector.start_consumer(tracker, callback)
+        start = time.perf_counter()
+        await asyncio.gather(*(self._stream(t, m, start, duration)
+                               for t, m in zip(self.connector.trackers, self.motions)))
+        # 等待消费协程处理完剩余数据包
+        while any(t.packet_queue for t in self.connector.trackers):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        for tracker in self.connector.trackers:
+            tracker.consumer_task.cancel()
+        return elapsed
+
+
+async def run_load(num_sensors: int, args, play_module=None):
+    fleet = VirtualFleet(num_sensors, args.rate, args.profile, args.strike_hz)
+    latency_ms = []
+
+    def callback(sensor_id, sensor_name, quat=None, accel=None, strike=None):
+        # 回调延迟：从击打峰值（对齐后的时间）到回调被调用
+        latency_ms.append((time.monotonic() + WALL_CLOCK_OFFSET - strike.timestamp) * 1000)
+        if play_module is not None:
+            play_module.sensor_moved(sensor_id % len(SENSOR_MAP), sensor_name, quat, accel, strike)
+
+    wall_time = await fleet.run(callback, args.duration)
+    if play_module is not None:
+        await asyncio.to_thread(play_module.hit_pipeline.wait_idle)
+    trackers = fleet.connector.trackers
+    expected = sum(m.strikes for m in fleet.motions)
+    latency_ms.sort()
+    return {
+        "sensors": num_sensors,
+        "throughput": sum(t.processed for t in trackers) / wall_time,
+        "queue_dropped": sum(t.dropped for t in trackers),
+        "strikes": expected,
+        "detected": len(latency_ms),
+        "p50": percentile(latency_ms, 50),
+        "p95": percentile(latency_ms, 95),
+        "p99": percentile(latency_ms, 99),
+    }
+
+
+async def main_async(args):
+    play_module = importlib.import_module(f"play_{args.mode}") if args.mode else None
+    results = []
+    for n in args.sensors:
+        print(f"运行 {n} 台虚拟传感器，{args.rate:.0f}Hz，{args.duration:.0f}秒 ...")
+        results.append(await run_load(n, args, play_module))
+    print("传感器数  吞吐(包/秒)  队列丢包  击打/检测  回调延迟p50/p95/p99(ms)")
+    for r in results:
+        print(f"{r['sensors']:>8}  {r['throughput']:>11,.0f}  {r['queue_dropped']:>8}  "
+              f"{r['strikes']:>4}/{r['detected']:<4}  "
+              f"{r['p50']:.2f}/{r['p95']:.2f}/{r['p99']:.2f}")
+    if play_module is not None:
+        play_module.hit_pipeline.print_stats()
+        play_module.music_continuator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="虚拟Mocopi传感器群压力测试")
+    parser.add_argument("--sensors", type=int, nargs="+", default=list(DEFAULT_SENSOR_COUNTS))
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_HZ, help="每台传感器的发包频率(Hz)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_SEC, help="每轮测试时长(秒)")
+    parser.add_argument("--profile", choices=PROFILES, default="periodic")
+    parser.add_argument("--strike-hz", type=float, default=DEFAULT_STRIKE_HZ)
+    parser.add_argument("--mode", choices=("with_aware", "without_aware", "with_sheet"), default=None,
+                        help="同时驱动对应 play_* 脚本的击打管线（需要模型文件）")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
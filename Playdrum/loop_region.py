@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class LoopRegion:
+    """
+    循环播放区域：生成段预先编译为按时间排序的事件数组（同一时间的击打合为一组），只编译一次。
+    第 k 遍中偏移为 offset 的事件在 anchor_ms + k * length_ms + offset 触发，length_ms = 段长 + 间隙，
+    触发时间总是由锚点直接算出，不会像逐遍 sleep 那样累积漂移；每一遍也不需要重新写入播放缓冲。
+    时间单位为毫秒，与调用方的时钟基准一致（MusicContinuator 中为相对 ref_perf 的毫秒）。
+    本身不加锁，由调用方串行化。
+    """
+
+    def __init__(self, offsets_ms, events, segment_ms: float, gap_ms: float = 0, anchor_ms: float = 0):
+        """
+        :param offsets_ms: 各事件相对段起点的毫秒偏移
+        :param events: 与 offsets_ms 对应的事件（如鼓件名）
+        :param segment_ms: 段长（毫秒），偏移不小于循环长度的事件不播放
+        :param gap_ms: 两遍之间的间隙（毫秒）
+        :param anchor_ms: 第0遍的起点
+        """
+        offsets_ms = np.asarray(offsets_ms, dtype=np.int64)
+        order = np.argsort(offsets_ms, kind='stable')
+        self.offsets, starts = np.unique(offsets_ms[order], return_index=True)
+        ends = starts[1:].tolist() + [len(order)]
+        self.events = [[events[i] for i in order[start:end].tolist()] for start, end in zip(starts.tolist(), ends)]
+        self.segment_ms = segment_ms
+        self.gap_ms = gap_ms
+        self.length_ms = max(segment_ms + gap_ms, 1)
+        self.anchor_ms = anchor_ms
+        self.pass_index = 0  # 当前是第几遍
+        self.index = 0  # 本遍下一个待触发的事件组
+        self.skipped = 0  # 落后超过一遍时跳过的事件组数
+        self._active = int(np.searchsorted(self.offsets, self.length_ms))  # 循环内的事件组数
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def next_due_ms(self):
+        """下一个事件组的触发时间，没有事件时返回 None"""
+        if not self._active:
+            return None
+        return self.anchor_ms + self.pass_index * self.length_ms + int(self.offsets[self.index])
+
+    def pop_due(self, now_ms: float):
+        """弹出所有触发时间 <= now_ms 的事件组，返回 [(触发时间, [事件, ...]), ...]"""
+        due = []
+        due_ms = self.next_due_ms()
+        if due_ms is None:
+            return due
+        if now_ms - due_ms >= self.length_ms:
+            # 落后超过一遍（如调度线程长时间被挂起）：按相位直接跳到当前位置，而不是把错过的几遍补播出来
+            self._seek(now_ms)
+            due_ms = self.next_due_ms()
+        while due_ms <= now_ms:
+            due.append((due_ms, self.events[self.index]))
+            self._advance()
+            due_ms = self.next_due_ms()
+        return due
+
+    def set_length(self, segment_ms=None, gap_ms=None):
+        """播放中修改段长/间隙：当前这一遍的起点不变，之后各遍按新的循环长度排列"""
+        pass_start = self.anchor_ms + self.pass_index * self.length_ms
+        if segment_ms is not None:
+            self.segment_ms = segment_ms
+        if gap_ms is not None:
+            self.gap_ms = gap_ms
+        self.length_ms = max(self.segment_ms + self.gap_ms, 1)
+        self.anchor_ms = pass_start - self.pass_index * self.length_ms
+        self._active = int(np.searchsorted(self.offsets, self.length_ms))
+        if self.index >= self._active:
+            self.index = 0
+            self.pass_index += 1
+
+    # ---------------- 内部方法 ----------------
+    def _advance(self):
+        self.index += 1
+        if self.index >= self._active:
+            self.index = 0
+            self.pass_index += 1
+
+    def _seek(self, now_ms: float):
+        pass_index, phase = divmod(now_ms - self.anchor_ms, self.length_ms)
+        index = int(np.searchsorted(self.offsets[:self._active], phase))
+        self.skipped += (int(pass_index) - self.pass_index) * self._active + index - self.index
+        self.pass_index = int(pass_index)
+        self.index = index
+        if self.index >= self._active:
+            self.index = 0
+            self.pass_index += 1
@@ -0,0 +1,77 @@
+import threading
+import time
+
+try:
+    import resource  # 仅 Unix 可用，用于读取进程峰值内存
+except ImportError:
+    resource = None
+
+# ===== 默认参数 =====
+GENERATOR_KEY = 'drum_kit'  # Drums RNN 的生成器配置
+
+
+class SharedGenerator:
+    """
+    进程内共享的 Drums RNN 生成器：首次使用时才读取模型并初始化计算图，
+    generate() 串行执行，多个线程可以安全地共用同一个会话。
+    """
+
+    def __init__(self, bundle_path: str):
+        self.bundle_path = bundle_path
+        self.bundle = None
+        self.lock = threading.RLock()  # 保护初始化与生成调用
+        self._generator = None
+
+    @property
+    def generator(self):
+        """底层 magenta 生成器（首次访问时加载）"""
+        if self._generator is None:
+            with self.lock:
+                if self._generator is None:
+                    self._generator = self._load()
+        return self._generator
+
+    def _load(self):
+        from magenta.models.drums_rnn import drums_rnn_sequence_generator
+        from magenta.models.shared import sequence_generator_bundle
+
+        start = time.perf_counter()
+        self.bundle = sequence_generator_bundle.read_bundle_file(self.bundle_path)
+        generator_map = drums_rnn_sequence_generator.get_generator_map()
+        generator = generator_map[GENERATOR_KEY](checkpoint=None, bundle=self.bundle)
+        generator.initialize()
+        print(f"[ModelRegistry] 已加载 {self.bundle_path}，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        return generator
+
+    def generate(self, primer_ns, generator_options):
+        with self.lock:
+            return self.generator.generate(primer_ns, generator_options)
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_generator(bundle_path: str) -> SharedGenerator:
+    """按模型路径返回进程内唯一的共享生成器（惰性加载）"""
+    with _registry_lock:
+        shared = _registry.get(bundle_path)
+        if shared is None:
+            shared = _registry[bundle_path] = SharedGenerator(bundle_path)
+        return shared
+
+
+def max_rss_mb():
+    """进程峰值常驻内存（MB），平台不支持时返回 None"""
+    if resource is None:
+        return None
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def print_startup_stats(label: str, start_time: float):
+    """输出从 start_time（perf_counter）到现在的启动耗时与峰值内存"""
+    rss = max_rss_mb()
+    rss_text = f"{rss:.0f}MB" if rss is not None else "未知"
+    print(f"[{label}] 启动耗时 {(time.perf_counter() - start_time) * 1000:.0f}ms，峰值内存 {rss_text}，"
+          f"已加载模型 {sum(1 for g in _registry.values() if g._generator is not None)} 个")
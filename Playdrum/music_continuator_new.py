@@ -1,14 +1,21 @@
 import os
 import time
+import itertools
 import threading
 import numpy as np
 import torch
 
-from magenta.models.drums_rnn import drums_rnn_sequence_generator
 from note_seq.protobuf import generator_pb2
 from note_seq.protobuf import music_pb2
 from drum_player import DrumPlayer
-from magenta.models.shared import sequence_generator_bundle
+from latency_trace import TRACER, STAGE_DISPATCH, LatencyHistogram
+from audio_trigger import AudioTriggerWorker
+from tick_wheel import TickWheel
+from loop_region import LoopRegion
+from hit_store import HitStore, arrays_to_note_sequence, midi_lookup
+from model_registry import get_generator
+from streaming_generator import StreamingDrumGenerator
+from continuation_cache import ContinuationCache, pattern_key
 
 # ===== 常量 =====
 PAD_IDX = 18819
@@ -26,11 +33,15 @@ MAX_CURRENT_HITS_NUM = 100000  # 累计击打数量达到后触发生成
 TIME_TOKEN_MS = 16
 MAX_TIME_TOKEN = 255
 MAX_HISTORY = 500
+PLAYBACK_HORIZON_MS = 70000  # 播放缓冲可提前调度的范围（70秒，容纳60秒生成音乐），决定时间轮的槽数
 
 # ===== 生成音乐参数 =====
-GENERATED_MUSIC_DURATION = 60  # 生成60秒的音乐
+GENERATED_MUSIC_DURATION = 60  # 生成60秒的音乐；分块流式生成时可设为 None，一直生成到停止
 LOOP_PLAYBACK = True  # 是否循环播放生成音乐
 LOOP_GAP = 0.5  # 循环间隙（秒），0表示无缝循环
+GENERATION_CHUNK_MS = 2000  # 分块生成的块长：一小节（Drums RNN 16步 × 125ms）
+GENERATION_LOOKAHEAD_MS = 4000  # 分块生成领先播放位置的距离（ms）
+ONE_SHOT_MUSIC_DURATION = 60  # GENERATED_MUSIC_DURATION 为 None 时，一次生成整段的路径（缓存命中、非分块、生成进程、旧实现）使用的时长（秒）
 
 # 鼓件词表
 DRUM_VOCAB = {
@@ -64,6 +75,7 @@ DRUM_TO_MIDI = {
     "cowbell": 56
 }
 MIDI_TO_DRUM = {v: k for k, v in DRUM_TO_MIDI.items()}
+DRUM_ID_TO_MIDI = midi_lookup(DRUM_VOCAB, DRUM_TO_MIDI)
 
 
 # ===== 环境加速 =====
@@ -89,18 +101,34 @@ def set_environment():
 
 
 class MusicContinuator:
-    def __init__(self, bundle_path: str):
+    def __init__(self, bundle_path: str, generation_worker=None, streaming_generation=True,
+                 continuation_cache=True, hit_store=None, chunked_generation=True):
+        """
+        :param bundle_path: Drums RNN 模型路径
+        :param generation_worker: 可选的 GenerationWorker，提供时在独立进程中生成，本进程不加载模型
+        :param streaming_generation: 本进程生成时使用流式生成器（引子只编码一次）
+        :param continuation_cache: 流式生成时按量化节奏型缓存续写（其他路径的生成结果包含完整引子，不缓存）
+        :param hit_store: 与其他组件共享的 HitStore；缺省时自建
+        :param chunked_generation: 流式生成时按小节分块生成，每块生成后立即调度，不等整段生成完
+        """
         set_environment()
         self.device = 'cuda'
-        self.bundle = sequence_generator_bundle.read_bundle_file(bundle_path)
-        generator_map = drums_rnn_sequence_generator.get_generator_map()
-        gen_key = 'drum_kit'
-        # 加载 Drums RNN 模型
-        self.generator = generator_map[gen_key](checkpoint=None, bundle=self.bundle)
-        self.generator.initialize()  # 初始化模型
+        self.generation_worker = generation_worker
+        # Drums RNN 模型：按路径共享，首次生成时才加载（使用生成进程时由子进程加载）
+        self.generator = get_generator(bundle_path) if generation_worker is None else None
+        self.streaming_generation = streaming_generation and self.generator is not None
+        self.streaming = None  # 首次生成时创建，避免启动时加载模型
+        self.last_hit_ms = 0
+        self.cache = ContinuationCache() if continuation_cache and self.streaming_generation else None
+        self.chunked_generation = chunked_generation and self.streaming_generation
+        self.chunk_streaming = False  # 分块生成是否正在进行（此时由生成线程调度生成音乐）
+        self._play_start_ms = None  # 分块生成的音乐段开始播放的时间（相对 ref_perf 的毫秒）
+        self._chunks_scheduled = 0  # 分块生成时 generated_hits[0] 中已调度的击打数
 
         self.drum_player = DrumPlayer()
-        self.current_hits = [[]]  # 累计输入击打（['drum', ms, name]）
+        self.trigger = AudioTriggerWorker(self.drum_player)  # 所有播放都经同一个常驻线程触发
+        # 累计输入击打（绝对毫秒 + 鼓件id），引子取最近 MAX_HISTORY 次
+        self.hit_store = hit_store if hit_store is not None else HitStore()
         self.generated_hits = [[]]  # 最近一轮模型生成（['drum', ms, name]）
         self.start_generation_step = False
         self.can_play_generated_music = False  # 是否可以播放生成音乐
@@ -114,10 +142,14 @@ class MusicContinuator:
         self._playback_stop = threading.Event()
         self._playback_lock = threading.Lock()
 
-        # playback buffer: key = absolute quantized tick index (int),
-        # value = list of drum_name to play at that tick.
-        self.playback_buffer = {}
+        # 播放缓冲：按量化刻度（相对 ref_time_ms）分槽的时间轮，槽内为该刻度要播放的鼓件列表；
+        # 最早的刻度变化时通过条件变量唤醒播放线程
+        self.playback_buffer = TickWheel(int(PLAYBACK_HORIZON_MS / TIME_TOKEN_MS))
         self.playback_buffer_lock = threading.Lock()
+        self.playback_cond = threading.Condition(self.playback_buffer_lock)
+        self.loop_region = None  # 循环播放的生成段，由播放线程按循环相位直接触发，不写入时间轮
+        self.lateness = LatencyHistogram()  # 刻度实际触发时间与应触发时间之差
+        self.scheduler_wakeups = 0
 
         # 参考时间基准（ms），所有绝对时间都以 self.ref_time_ms 为基准
         self.ref_time_ms = None
@@ -126,7 +158,7 @@ class MusicContinuator:
         # 控制线程退出
         self._stop_playback = threading.Event()
 
-        self.current_hits_lock = threading.Lock()
+        self.streaming_lock = threading.Lock()  # 保护流式生成器的创建与 observe，避免首次引子漏掉或重复击打
         self.generated_hits_lock = threading.Lock()
 
         # 启动持续播放线程
@@ -136,7 +168,10 @@ class MusicContinuator:
         print("Music Continuator Drum Model 成功加载并启动播放调度线程")
 
 
-    def input_a_hit(self, drum_name: str, abs_time: float):
+    def input_a_hit(self, drum_name: str, abs_time: float, velocity: int = None, record=True):
+        """
+        :param record: 是否写入 hit_store；与 DrumAwareProb 共享 hit_store 时，修正后的击打已由其写入，传 False
+        """
         if drum_name not in DRUM_VOCAB:
             return
         # 检查是否可以开始播放生成音乐
@@ -146,19 +181,20 @@ class MusicContinuator:
             self.ref_time_ms = int(abs_time * 1000)
             self.ref_perf = time.perf_counter()
         rel_ms = int(round((abs_time * 1000) - self.ref_time_ms))
-        with self.current_hits_lock:
-            self.current_hits[0].append(['drum', rel_ms, drum_name])
-        # 立刻把这个输入的击打加入播放缓冲（量化）
-        self._schedule_hit(rel_ms, drum_name)
-        # 触发本地播放（非阻塞）
-        self._safe_play(drum_name)
+        with self.streaming_lock:
+            if record:
+                self.hit_store.append(int(round(abs_time * 1000)), DRUM_VOCAB[drum_name], velocity)
+            self.last_hit_ms = rel_ms
+            if self.streaming is not None:
+                self.streaming.observe(drum_name, rel_ms)
+        # 触发本地播放（非阻塞）；实时击打不进入播放缓冲，否则调度线程会把它作为过期事件再播放一次
+        self._safe_play(drum_name, velocity)
         # 检查是否触发模型生成
-        with self.current_hits_lock:
-            if not self.start_generation_step and len(self.current_hits[0]) >= MAX_CURRENT_HITS_NUM:
-                self.start_generation_step = True
-                self.can_play_generated_music = False
-                print(f"已达到 {MAX_CURRENT_HITS_NUM} 个击打，启动自动生成")
-        if self.start_generation_step and not self.generating:
+        if not self.start_generation_step and self.hit_store.count >= MAX_CURRENT_HITS_NUM:
+            self.start_generation_step = True
+            self.can_play_generated_music = False
+            print(f"已达到 {MAX_CURRENT_HITS_NUM} 个击打，启动自动生成")
+        if self.start_generation_step and not self.generating and not self._segment_playing():
             threading.Thread(target=self._generate_loop, daemon=True).start()
 
 
@@ -168,20 +204,29 @@ class MusicContinuator:
 
 
 
+    def _segment_playing(self):
+        """
+        生成音乐是否仍在播放（分块生成中、循环中或播放缓冲中还有待播放的生成击打）。
+        此时不开始新一轮生成，否则新一轮会重置播放状态，覆盖正在播放的音乐段。
+        """
+        return self.chunk_streaming or self.music_loop_active or len(self.playback_buffer) > 0
+
     def _check_play_generated_music(self, drum_name: str):
         """检查是否满足播放生成音乐的条件"""
         if self.start_generation_step and not self.can_play_generated_music and self.generated_music_ready:
-            with self.current_hits_lock:
-                if len(self.current_hits[0]) >= MAX_CURRENT_HITS_NUM:
-                    self.can_play_generated_music = True
-                    print(f"[DEBUG] 检测到额外击打，开始播放60秒生成音乐")
-                    # 启动音乐循环播放
-                    if LOOP_PLAYBACK:
-                        self.music_loop_active = True
-                        threading.Thread(target=self._music_loop_playback, daemon=True).start()
-                    else:
-                        # 非循环模式，直接调度一次播放
-                        self._schedule_generated_music()
+            if self.hit_store.count >= MAX_CURRENT_HITS_NUM:
+                self.can_play_generated_music = True
+                print(f"[DEBUG] 检测到额外击打，开始播放生成音乐")
+                if self.chunk_streaming:
+                    # 分块生成：记录播放起点并调度已生成的块，之后的块由生成线程在生成后调度
+                    self._play_start_ms = self._current_ms()
+                    self._schedule_new_chunks()
+                # 启动音乐循环播放
+                elif LOOP_PLAYBACK:
+                    self._start_loop_region()
+                else:
+                    # 非循环模式，直接调度一次播放
+                    self._schedule_generated_music()
 
     def _schedule_generated_music(self):
         """将生成的音乐调度到播放缓冲"""
@@ -189,32 +234,47 @@ class MusicContinuator:
             if not self.generated_hits or not self.generated_hits[0]:
                 return
             # 计算当前时间，用于调整生成音乐的时间偏移
-            if self.ref_time_ms is None:
-                current_ms = 0
-            else:
-                elapsed_s = time.perf_counter() - self.ref_perf
-                current_ms = int(round(elapsed_s * 1000))
-            # 调度生成音乐，从当前时间开始播放
-            for hit in self.generated_hits[0]:
-                _, t_ms, drum_name = hit
-                # 将生成音乐的时间调整到从当前时间开始播放
-                adjusted_ms = current_ms + t_ms
-                self._schedule_hit(adjusted_ms, drum_name)
-            print(f"已调度 {len(self.generated_hits[0])} 个生成击打到播放缓冲")
+            current_ms = self._current_ms()
+            # 调度生成音乐，从当前时间开始播放（整段一次写入播放缓冲）
+            hits = self.generated_hits[0]
+            t_ms = np.fromiter((hit[1] for hit in hits), dtype=np.int64, count=len(hits))
+            self._schedule_hits(current_ms + t_ms, [hit[2] for hit in hits])
+            print(f"已调度 {len(hits)} 个生成击打到播放缓冲")
+
+    def _start_loop_region(self, anchor_ms=None) -> bool:
+        """
+        把生成音乐编译为循环区域（只编译一次），从 anchor_ms（缺省为当前时间）开始循环播放。
+        每一遍的触发时间由锚点和循环长度直接算出，不再逐遍 sleep 后重新写入播放缓冲。
+        :return: 是否已开始循环（没有生成音乐或音乐没有段长时返回 False）
+        """
+        with self.generated_hits_lock:
+            # 无限分块生成的音乐没有段长，不能循环
+            if not self.generated_hits or not self.generated_hits[0] or self.music_segment_duration is None:
+                return False
+            hits = self.generated_hits[0]
+            t_ms = np.fromiter((hit[1] for hit in hits), dtype=np.int64, count=len(hits))
+            # 与播放缓冲一样量化到 TIME_TOKEN_MS 刻度
+            offsets_ms = np.rint(t_ms / TIME_TOKEN_MS).astype(np.int64) * TIME_TOKEN_MS
+            region = LoopRegion(offsets_ms, [hit[2] for hit in hits], self.music_segment_duration,
+                                LOOP_GAP * 1000, anchor_ms=self._current_ms() if anchor_ms is None else anchor_ms)
+        with self.playback_cond:
+            self.loop_region = region
+            self.music_loop_active = True
+            self.playback_cond.notify()
+        print(f"启动生成音乐循环播放（{len(hits)} 个击打，循环长度 {region.length_ms / 1000:.1f}秒）")
+        return True
 
-    def _music_loop_playback(self):
-        """循环播放生成音乐"""
-        print(f"启动生成音乐循环播放")
-        self.music_loop_active = True
-        while self.music_loop_active and not self._stop_playback.is_set():
-            # 调度当前循环的音乐
-            self._schedule_generated_music()
-            # 计算需要等待的时间（音乐时长 + 间隙）
-            wait_time = (self.music_segment_duration / 1000.0) + LOOP_GAP
-            print(f"音乐循环播放完成，等待 {wait_time:.1f}秒后重新播放")
-            # 等待下一轮循环
-            time.sleep(wait_time)
-        print(f"音乐循环播放已停止")
+    def set_loop_length(self, segment_ms=None, gap_sec=None):
+        """
+        播放中修改循环的段长（毫秒）和间隙（秒），当前这一遍不受影响
+        """
+        with self.playback_cond:
+            if self.loop_region is None:
+                return
+            self.loop_region.set_length(segment_ms, None if gap_sec is None else gap_sec * 1000)
+            self.playback_cond.notify()  # 下一个触发时间可能提前
+            length_ms = self.loop_region.length_ms
+        print(f"[DEBUG] 循环长度更新为 {length_ms / 1000:.1f}秒")
 
 
 
@@ -233,53 +293,57 @@ class MusicContinuator:
 
     def _schedule_hit(self, rel_ms: int, drum_name: str):
         """
-        rel_ms: 相对于 self.ref_time_ms 的毫秒（int），可以为负（非常早的输入）——仍会放入 buffer
+        rel_ms: 相对于 self.ref_time_ms 的毫秒（int），可以为负（非常早的输入）——会在下一个刻度立即触发
+        """
+        self._schedule_hits([rel_ms], [drum_name])
+
+    def _schedule_hits(self, rel_ms, drum_names):
+        """
+        批量调度：一次加锁写入整段击打，最多唤醒播放线程一次。
+        时间轮的插入是 O(1)，过期的刻度在触发时随槽一起清空，不再需要扫描整个缓冲区。
         """
-        tick = self._quantize_ms_to_tick(rel_ms)
-        with self.playback_buffer_lock:
-            if tick not in self.playback_buffer:
-                self.playback_buffer[tick] = []
-            self.playback_buffer[tick].append(drum_name)
-        # keep buffer small: 清理过期刻度（比当前早很多的）
-        self._prune_old_ticks()
-
-    def _prune_old_ticks(self):
-        # 删除比当前 tick 早超过 BUFFER_WINDOW_TICKS 的条目
-        WINDOW_MS = 70000  # 保留70秒，适应60秒循环音乐
+        ticks = np.rint(np.asarray(rel_ms, dtype=np.float64) / TIME_TOKEN_MS).astype(np.int64).tolist()
         now_tick = self._current_tick()
-        if now_tick is None:
-            return
-        prune_before = now_tick - int(WINDOW_MS / TIME_TOKEN_MS)
-        with self.playback_buffer_lock:
-            # 构造待删除列表避免运行时修改字典
-            to_del = [t for t in self.playback_buffer.keys() if t < prune_before]
-            for t in to_del:
-                del self.playback_buffer[t]
+        with self.playback_cond:
+            if now_tick is not None:
+                self.playback_buffer.advance_to(now_tick)  # 空闲期间 cursor 没有前移
+            earliest = self.playback_buffer.next_tick()
+            rejected = self.playback_buffer.rejected
+            self.playback_buffer.insert_many(ticks, drum_names)
+            if self.playback_buffer.next_tick() != earliest:
+                self.playback_cond.notify()  # 新的最早刻度，播放线程需要提前醒来
+            rejected = self.playback_buffer.rejected - rejected
+        if rejected:
+            print(f"[WARN] {rejected} 个击打超出播放缓冲范围（{PLAYBACK_HORIZON_MS}ms），已丢弃")
+
+    def _current_ms(self) -> float:
+        """当前时间相对 ref_perf 的毫秒，尚无参考时间时为 0"""
+        if self.ref_perf is None:
+            return 0
+        return (time.perf_counter() - self.ref_perf) * 1000
 
     def _current_tick(self):
+        """当前时间所在的刻度（已到期的最大刻度）"""
         if self.ref_time_ms is None or self.ref_perf is None:
             return None
         elapsed_s = time.perf_counter() - self.ref_perf
-        elapsed_ms = int(round(elapsed_s * 1000))
-        return self._quantize_ms_to_tick(elapsed_ms + 0)  # +0 for clarity
+        return int(elapsed_s * 1000 // TIME_TOKEN_MS)
 
     # ================= 编解码（保留原实现） =================
     def encode_hits_to_tokens(self):
         # 可保留用于调试
-        if not self.current_hits or not self.current_hits[0]:
+        ticks, drum_ids = self._primer(None)
+        if len(ticks) == 0:
             return [START_TOKEN]
 
-        seq = sorted(self.current_hits[0], key=lambda x: x[1])
-        tokens = [START_TOKEN]
-        last_time = 0
-        for _, t_ms, drum_name in seq:
-            delta_ms = max(0, t_ms - last_time)
-            dt_tok = max(0, min(MAX_TIME_TOKEN, int(round(delta_ms / TIME_TOKEN_MS))))
-            tokens.append(dt_tok)
-            drum_id = DRUM_VOCAB[drum_name]
-            tokens.append(DRUM_BASE_TOKEN + drum_id)
-            last_time = t_ms
-        return tokens
+        order = np.argsort(ticks, kind='stable')
+        ticks, drum_ids = ticks[order], drum_ids[order]
+        deltas = np.diff(ticks, prepend=0).clip(min=0)
+        tokens = np.empty(2 * len(ticks) + 1, dtype=np.int64)
+        tokens[0] = START_TOKEN
+        tokens[1::2] = np.rint(deltas / TIME_TOKEN_MS).clip(0, MAX_TIME_TOKEN)
+        tokens[2::2] = DRUM_BASE_TOKEN + drum_ids.astype(np.int64)
+        return tokens.tolist()
 
     def decode_tokens_to_hits(self, tokens):
         hits = []
@@ -303,22 +367,14 @@ class MusicContinuator:
         return hits
 
     # ================= NoteSequence 转换 =================
+    def _primer(self, n=MAX_HISTORY):
+        """最近 n 次输入击打（n 为 None 时为全部保留的击打），返回 (相对 ref_time_ms 的 tick_ms 数组, 鼓件id 数组)"""
+        view = self.hit_store.tail(n)
+        return view.timestamps - (self.ref_time_ms or 0), view.drum_ids
+
     def hits_to_note_sequence(self):
-        ns = music_pb2.NoteSequence()
-        ns.tempos.add(qpm=120)  # 默认 120 BPM
-        last_time = 0
-        seq = sorted(self.current_hits[0], key=lambda x: x[1])
-        for _, t_ms, drum_name in seq:
-            t_sec = t_ms / 1000.0
-            note = ns.notes.add()
-            note.instrument = 10  # 鼓组通道
-            note.pitch = DRUM_TO_MIDI.get(drum_name, 36)
-            note.velocity = 100
-            note.start_time = t_sec
-            note.end_time = t_sec + 0.125  # 16分音符
-            last_time = max(last_time, note.end_time)  # 更新最后时间
-        ns.total_time = last_time  # **确保 total_time 正确**
-        return ns
+        ticks, drum_ids = self._primer()
+        return arrays_to_note_sequence(music_pb2, ticks, DRUM_ID_TO_MIDI[drum_ids])
 
     def note_sequence_to_hits(self, ns):
         hits = []
@@ -334,36 +390,82 @@ class MusicContinuator:
         self.music_segment_duration = max_time_ms
         return hits
 
+    def arrays_to_hits(self, ticks, pitches, end_ms):
+        """生成进程返回的 (tick_ms, 音高) 数组转换为击打，等价于 note_sequence_to_hits"""
+        hits = [['drum', t_ms, MIDI_TO_DRUM[p]] for t_ms, p in zip(ticks.tolist(), pitches.tolist())
+                if p in MIDI_TO_DRUM]
+        self.music_segment_duration = end_ms
+        return hits
+
     # ================= 后台生成（生成60秒音乐） =================
     def _generate_loop(self):
         self.generating = True
-        print(f"[DEBUG] 开始生成 {GENERATED_MUSIC_DURATION} 秒鼓点...")
+        # 只有分块流式生成支持无限时长，其他路径一次生成固定时长
+        duration_sec = GENERATED_MUSIC_DURATION if GENERATED_MUSIC_DURATION is not None else ONE_SHOT_MUSIC_DURATION
+        print(f"[DEBUG] 开始生成 {GENERATED_MUSIC_DURATION} 秒鼓点..." if GENERATED_MUSIC_DURATION is not None
+              else "[DEBUG] 开始持续分块生成鼓点...")
 
         try:
-            # 一次性生成60秒音乐
-            with self.current_hits_lock:
-                if len(self.current_hits[0]) > MAX_HISTORY:
-                    self.current_hits[0] = self.current_hits[0][-MAX_HISTORY:]
-                primer_ns = self.hits_to_note_sequence()
-
-            print(f"[DEBUG] 输入击打数量: {len(self.current_hits[0])}")
+            # 流式生成按小节分块（_generate_chunks），其他路径一次性生成整段
+            if self.streaming_generation and self.streaming is None:
+                # 首次生成：建立流式生成器，并用已有击打作为引子（只编码这一次）
+                streaming = StreamingDrumGenerator(self.generator, DRUM_TO_MIDI, temperature=MODEL_TEMPERATURE)
+                with self.streaming_lock:
+                    ticks, drum_ids = self._primer()
+                    order = np.argsort(ticks, kind='stable')
+                    for t_ms, drum_id in zip(ticks[order].tolist(), drum_ids[order].tolist()):
+                        streaming.observe(ID2DRUM[drum_id], t_ms)
+                    self.streaming = streaming
+            # 流式生成器已持有全部历史，不再重建引子
+            primer_ticks, primer_ids = self._primer()
+            if self.streaming is None and self.generation_worker is None:
+                primer_ns = arrays_to_note_sequence(music_pb2, primer_ticks, DRUM_ID_TO_MIDI[primer_ids])
+
+            print(f"[DEBUG] 输入击打数量: {len(primer_ticks)}")
             start_time = time.time()
 
-            generator_options = generator_pb2.GeneratorOptions()
-            generate_section = generator_options.generate_sections.add()
-            generate_section.start_time = primer_ns.total_time  # 从序列末尾开始生成
-            generate_section.end_time = primer_ns.total_time + GENERATED_MUSIC_DURATION  # 生成60秒
-            generator_options.args['temperature'].float_value = MODEL_TEMPERATURE
+            if self.streaming is not None:
+                # 从最后一次击打之后续写，时间换算为从0开始的音乐段；相同节奏型直接复用缓存
+                base_ms = self.last_hit_ms
+                _, key = pattern_key(primer_ticks, primer_ids) if self.cache is not None else (None, None)
+                cached = self.cache.lookup(key) if key is not None else None
+                if cached is not None:
+                    gen_hits = [['drum', t_ms, ID2DRUM[drum_id]] for t_ms, drum_id in zip(cached.ticks, cached.drum_ids)]
+                elif self.chunked_generation:
+                    self._generate_chunks(base_ms, key, start_time)
+                    return
+                else:
+                    gen_hits = [['drum', t_ms - base_ms, drum_name] for t_ms, drum_name
+                                in self.streaming.generate_window(base_ms, duration_sec * 1000)]
+                    if key is not None:
+                        self.cache.store(key, ((t_ms, DRUM_VOCAB[drum_name]) for _, t_ms, drum_name in gen_hits),
+                                         generation_ms=(time.time() - start_time) * 1000)
+            elif self.generation_worker is not None:
+                result = self.generation_worker.generate(primer_ticks, DRUM_ID_TO_MIDI[primer_ids],
+                                                         duration_sec, MODEL_TEMPERATURE)
+                if result is None:
+                    return
+            else:
+                generator_options = generator_pb2.GeneratorOptions()
+                generate_section = generator_options.generate_sections.add()
+                generate_section.start_time = primer_ns.total_time  # 从序列末尾开始生成
+                generate_section.end_time = primer_ns.total_time + duration_sec  # 生成60秒
+                generator_options.args['temperature'].float_value = MODEL_TEMPERATURE
 
-            generated_ns = self.generator.generate(primer_ns, generator_options)
+                generated_ns = self.generator.generate(primer_ns, generator_options)
             print(f"[DEBUG] 60秒音乐生成完成，耗时: {time.time() - start_time:.2f}秒")
 
             # 把生成的 NoteSequence 转为击打，但不立即调度
             with self.generated_hits_lock:
-                gen_hits = self.note_sequence_to_hits(generated_ns)
+                if self.streaming is not None:
+                    self.music_segment_duration = duration_sec * 1000
+                elif self.generation_worker is not None:
+                    gen_hits = self.arrays_to_hits(result[1], result[2], result[3])
+                else:
+                    gen_hits = self.note_sequence_to_hits(generated_ns)
                 self.generated_hits = [gen_hits]  # 存储但不播放
                 self.generated_music_ready = True  # 标记音乐已生成
-                print(f"[DEBUG] 生成了 {len(gen_hits)} 个鼓点（{GENERATED_MUSIC_DURATION}秒），等待额外击打触发循环播放")
+                print(f"[DEBUG] 生成了 {len(gen_hits)} 个鼓点（{duration_sec}秒），等待额外击打触发循环播放")
 
             # 等待播放条件满足
             while self.start_generation_step and not self.can_play_generated_music and not self._stop_playback.is_set():
@@ -376,101 +478,206 @@ class MusicContinuator:
             self.generating = False
             print("[DEBUG] 生成线程结束")
 
+    def _generate_chunks(self, base_ms: int, key, start_time: float):
+        """
+        分块流式生成：从同一个推测分支逐小节生成，每块生成后立即调度到播放缓冲，
+        生成保持领先播放位置 GENERATION_LOOKAHEAD_MS（播放开始前只预生成这么多）。
+        第一块生成完即可开始播放；GENERATED_MUSIC_DURATION 为 None 时一直生成到停止。
+        :param base_ms: 续写起点（最后一次击打），音乐段的时间从这里算起
+        :param key: 续写缓存的键，有限时长的生成完成后写入缓存
+        """
+        duration_ms = None if GENERATED_MUSIC_DURATION is None else GENERATED_MUSIC_DURATION * 1000
+        stream = self.streaming.stream(base_ms, None if duration_ms is None else base_ms + duration_ms)
+        with self.generated_hits_lock:
+            self.generated_hits = [[]]
+            self.music_segment_duration = duration_ms
+            self._chunks_scheduled = 0
+        self._play_start_ms = None
+        self.chunk_streaming = True
+        carry = None  # 已采样出、属于下一块的击打
+        chunk_index = 0
+        try:
+            while self.chunk_streaming and not self._stop_playback.is_set():
+                chunk_end_ms = (chunk_index + 1) * GENERATION_CHUNK_MS
+                chunk_start = time.time()
+                hits = []
+                pending, carry = ([carry] if carry is not None else []), None
+                for t_ms, drums in itertools.chain(pending, stream):
+                    if t_ms - base_ms >= chunk_end_ms:
+                        carry = (t_ms, drums)
+                        break
+                    hits.extend(['drum', t_ms - base_ms, drum_name] for drum_name in drums)
+                with self.generated_hits_lock:
+                    self.generated_hits[0].extend(hits)
+                if chunk_index == 0:
+                    self.generated_music_ready = True
+                    if self.can_play_generated_music and self._play_start_ms is None:
+                        # 上一段已播放完（满足过播放条件）：新的一段生成出第一小节后直接开始播放
+                        self._play_start_ms = self._current_ms()
+                    print(f"[DEBUG] 第一小节生成完成，耗时: {time.time() - chunk_start:.2f}秒，等待额外击打触发播放")
+                chunk_index += 1
+                if carry is None:
+                    break  # 到达 GENERATED_MUSIC_DURATION
+                # 保持领先播放位置 GENERATION_LOOKAHEAD_MS
+                while self.chunk_streaming and not self._stop_playback.is_set():
+                    self._schedule_new_chunks()
+                    play_start_ms = self._current_ms() if self._play_start_ms is None else self._play_start_ms
+                    ahead_ms = play_start_ms + chunk_index * GENERATION_CHUNK_MS - self._current_ms()
+                    if ahead_ms <= GENERATION_LOOKAHEAD_MS:
+                        break
+                    time.sleep(min((ahead_ms - GENERATION_LOOKAHEAD_MS) / 1000, 0.1))
+
+            print(f"[DEBUG] 分块生成结束：{chunk_index} 小节，耗时: {time.time() - start_time:.2f}秒")
+            if duration_ms is None:
+                return
+            if key is not None:
+                with self.generated_hits_lock:
+                    gen_hits = list(self.generated_hits[0])
+                self.cache.store(key, ((t_ms, DRUM_VOCAB[drum_name]) for _, t_ms, drum_name in gen_hits),
+                                 generation_ms=(time.time() - start_time) * 1000)
+            # 等待播放开始，调度剩余的块；循环播放从第二遍起交给循环区域
+            while self.start_generation_step and self._play_start_ms is None and not self._stop_playback.is_set():
+                time.sleep(0.1)
+            if self._play_start_ms is None:
+                return
+            self._schedule_new_chunks()
+            if LOOP_PLAYBACK:
+                self._start_loop_region(anchor_ms=self._play_start_ms + duration_ms + LOOP_GAP * 1000)
+        finally:
+            self.chunk_streaming = False
+
+    def _schedule_new_chunks(self):
+        """播放开始后把尚未调度的生成击打一次写入播放缓冲（生成线程与击打线程都会调用）"""
+        if self._play_start_ms is None:
+            return
+        with self.generated_hits_lock:
+            hits = self.generated_hits[0][self._chunks_scheduled:]
+            self._chunks_scheduled += len(hits)
+        if hits:
+            t_ms = np.fromiter((hit[1] for hit in hits), dtype=np.int64, count=len(hits))
+            self._schedule_hits(self._play_start_ms + t_ms, [hit[2] for hit in hits])
+
     # ================= 持续播放线程 =================
+    def _due_perf(self, due_ms: float) -> float:
+        """相对 ref_perf 的毫秒时间对应的 perf_counter 时间（秒）"""
+        return self.ref_perf + due_ms / 1000.0
+
+    def _next_due_ms(self):
+        """时间轮与循环区域中最早的触发时间（相对 ref_perf 的毫秒），都为空时返回 None"""
+        next_tick = self.playback_buffer.next_tick()
+        due_ms = None if next_tick is None else next_tick * TIME_TOKEN_MS
+        if self.loop_region is not None:
+            loop_due_ms = self.loop_region.next_due_ms()
+            if loop_due_ms is not None and (due_ms is None or loop_due_ms < due_ms):
+                due_ms = loop_due_ms
+        return due_ms
+
     def _playback_loop(self):
         """
-        持续运行：按刻度检查 playback_buffer，触发该刻度上的所有击打（并发触发）。
+        持续运行：睡眠到时间轮或循环区域中最早的触发时间（有更早的事件插入时被条件变量唤醒），
+        把每个已到期时间点上的击打作为一批交给触发线程，并记录每个时间点的触发延迟。
+        没有待播放的刻度时一直等待，空闲时不占用 CPU。
         """
-        MIN_SLEEP = 0.002  # 最小 sleep 精度
         print("[DEBUG] 播放调度线程已启动")
         while not self._stop_playback.is_set():
-            if self.ref_time_ms is None:
-                # 没有启用时间参考，短暂等待
-                time.sleep(0.01)
-                continue
-            now_perf = time.perf_counter()
-            elapsed_ms = int(round((now_perf - self.ref_perf) * 1000))
-            current_tick = self._quantize_ms_to_tick(elapsed_ms)
-
-            # 取出当前 tick 的事件并触发
-            with self.playback_buffer_lock:
-                events = self.playback_buffer.pop(current_tick, None)
-
-            if events:
-                # 并发触发该刻度上的所有击打
-                for drum in events:
-                    self._spawn_play(drum)
-
-            # 微小睡眠以节省 CPU，但仍保持精度
-            time.sleep(MIN_SLEEP)
+            due_events = []
+            with self.playback_cond:
+                due_ms = self._next_due_ms() if self.ref_perf is not None else None
+                if due_ms is None:
+                    self.playback_cond.wait()
+                    self.scheduler_wakeups += 1
+                    continue
+                delay = self._due_perf(due_ms) - time.perf_counter()
+                if delay > 0:
+                    self.playback_cond.wait(delay)
+                    self.scheduler_wakeups += 1
+                    continue
+                # 取出所有已到期的刻度和循环事件（线程睡过头时也不会漏掉）
+                due_events = [(tick * TIME_TOKEN_MS, events)
+                              for tick, events in self.playback_buffer.pop_due(self._current_tick())]
+                if self.loop_region is not None:
+                    due_events.extend(self.loop_region.pop_due(self._current_ms()))
+
+            for due_ms, events in due_events:
+                self.lateness.record((time.perf_counter() - self._due_perf(due_ms)) * 1000)
+                # 同一刻度的击打作为一批提交，在同一次唤醒中连续触发
+                self.trigger.trigger_batch([(drum, None, None) for drum in events])
 
         print("[DEBUG] 播放调度线程已停止")
 
-    def _spawn_play(self, drum_name):
+    def _spawn_play(self, drum_name, velocity=None, trace_id=None):
         """
-        将播放实际调用放入独立线程，使得同一时刻多个声音可以并行触发（避免串行阻塞）。
+        把一次播放交给常驻的触发线程（非阻塞），不再为每次击打新建线程。
         """
-        t = threading.Thread(target=self._call_play_safe, args=(drum_name,), daemon=True)
-        t.start()
-
-    def _call_play_safe(self, drum_name):
-        try:
-            self.drum_player.play(drum_name)
-        except Exception as e:
-            print(f"[ERROR] _call_play_safe 播放失败 {drum_name}: {e}")
+        self.trigger.trigger(drum_name, velocity, trace_id)
 
     # 保留向后兼容的接口（其他地方可能仍调用）
-    def _safe_play(self, drum_name: str):
+    def _safe_play(self, drum_name: str, velocity: int = None, trace_id=None):
         """
         立即触发一次播放（非阻塞）。
-        也会在播放缓冲中预写当前刻度（避免丢失）。
+        不写入播放缓冲：调度线程会补触发所有过期刻度，写入会导致同一击打播放两次。
         """
         if self.ref_time_ms is None:
             # 如果还没有参考时间，立刻设定，保证缓冲和 perf 的参考一致
             self.ref_time_ms = int(time.time() * 1000)
             self.ref_perf = time.perf_counter()
 
-        # 立即在播放缓冲中安排当前刻度
-        now_elapsed_ms = int(round((time.perf_counter() - self.ref_perf) * 1000))
-        quant_tick = self._quantize_ms_to_tick(now_elapsed_ms)
-        with self.playback_buffer_lock:
-            if quant_tick not in self.playback_buffer:
-                self.playback_buffer[quant_tick] = []
-            self.playback_buffer[quant_tick].append(drum_name)
-
-        # 并行触发一次播放（以降低感知延迟）
-        self._spawn_play(drum_name)
+        # 交给触发线程播放（非阻塞，以降低感知延迟）
+        TRACER.stamp(trace_id, STAGE_DISPATCH)
+        self._spawn_play(drum_name, velocity, trace_id)
 
     # ================= 控制方法 =================
     def stop_music_loop(self):
-        """停止音乐循环播放"""
-        self.music_loop_active = False
+        """停止音乐循环播放（以及正在进行的分块生成）"""
+        self.chunk_streaming = False
+        with self.playback_cond:
+            self.loop_region = None
+            self.music_loop_active = False
         print("[DEBUG] 音乐循环播放已停止")
 
-    def start_music_loop(self):
-        """手动启动音乐循环播放（如果已生成音乐）"""
-        if self.generated_music_ready and not self.music_loop_active:
-            self.can_play_generated_music = True
-            self.music_loop_active = True
-            threading.Thread(target=self._music_loop_playback, daemon=True).start()
-            print("[DEBUG] 手动启动音乐循环播放")
+    def start_music_loop(self) -> bool:
+        """手动启动音乐循环播放（如果已生成音乐），返回是否已开始循环"""
+        if self.music_loop_active:
+            return True
+        if not self.generated_music_ready or self.chunk_streaming or not self._start_loop_region():
+            print("[WARN] 没有可循环的生成音乐（尚未生成、仍在分块生成或为无限时长），未启动循环播放")
+            return False
+        self.can_play_generated_music = True
+        print("[DEBUG] 手动启动音乐循环播放")
+        return True
 
     # ================= 其他工具方法 =================
     def stop(self):
         """在程序退出或不需要时调用"""
         self._stop_playback.set()
+        with self.playback_cond:
+            self.playback_cond.notify()
         self.music_loop_active = False
         self.can_play_generated_music = False
         self.generated_music_ready = False
         self.generating = False
         if self._playback_thread and self._playback_thread.is_alive():
             self._playback_thread.join(timeout=1.0)
+        self.trigger.close()
+        self.trigger.print_stats("MusicContinuator")
+        if self.cache is not None:
+            self.cache.print_stats("MusicContinuator")
+        self.lateness.print_summary(f"[MusicContinuator] 调度延迟（唤醒 {self.scheduler_wakeups} 次，"
+                                    f"过期插入 {self.playback_buffer.late_inserts} 次，"
+                                    f"超出范围丢弃 {self.playback_buffer.rejected} 次）")
         print("[DEBUG] MusicContinuator 已停止")
 
-    def set_generation_params(self, duration: int = 60, loop: bool = True, gap: float = 0.5):
-        """动态调整生成参数"""
-        global GENERATED_MUSIC_DURATION, LOOP_PLAYBACK, LOOP_GAP
+    def set_generation_params(self, duration: int = 60, loop: bool = True, gap: float = 0.5, lookahead=None):
+        """
+        动态调整生成参数
+        :param duration: 生成时长（秒），分块流式生成时 None 表示一直生成（其他路径使用 ONE_SHOT_MUSIC_DURATION）
+        :param lookahead: 分块生成领先播放位置的距离（秒），None 表示不修改
+        """
+        global GENERATED_MUSIC_DURATION, LOOP_PLAYBACK, LOOP_GAP, GENERATION_LOOKAHEAD_MS
         GENERATED_MUSIC_DURATION = duration
         LOOP_PLAYBACK = loop
         LOOP_GAP = gap
+        if lookahead is not None:
+            GENERATION_LOOKAHEAD_MS = lookahead * 1000
+        self.set_loop_length(gap_sec=gap)  # 正在循环时立即生效
         print(f"[DEBUG] 生成参数更新: 音乐时长={duration}s, 循环播放={loop}, 间隙={gap}s")
\ No newline at end of file
@@ -0,0 +1,118 @@
+import math
+from collections import namedtuple
+
+# 击打事件：timestamp为峰值时刻（秒），strength为峰值高出自适应基线的幅度，velocity为1~127的力度
+# trace_id：启用延迟追踪时由 SensorConnector 填入，贯穿后续处理阶段
+Strike = namedtuple("Strike", ["sensor_id", "timestamp", "strength", "velocity", "trace_id"], defaults=(None,))
+
+# ===== 默认参数 =====
+GRAVITY_TAU = 0.5  # 去除重力/姿态缓变分量的时间常数（秒）
+SMOOTH_TAU = 0.008  # 包络平滑时间常数（秒）
+NOISE_TAU = 1.0  # 噪声基线统计的时间常数（秒）
+THRESHOLD_K = 4.0  # 阈值 = 噪声均值 + K * 噪声平均绝对偏差
+MIN_THRESHOLD = 0.3  # 阈值下限（与加速度单位一致）
+REFRACTORY_SEC = 0.05  # 不应期：两次击打之间的最小间隔（秒）
+VELOCITY_FULL_SCALE = 4.0  # 对应力度127的峰值强度
+MAX_DT = 0.1  # 数据包间隔上限（秒），避免断流后滤波器跳变
+WARMUP_SEC = 0.5  # 启动预热时长（秒）：只建立基线，不报告击打
+WARMUP_GRAVITY_TAU = 0.1  # 预热期间的基线时间常数（秒），快速收敛
+MAX_STRIKE_SEC = 0.2  # 包络持续高于阈值超过该时长视为基线偏移（如启动时正在运动），恢复基线跟踪
+
+
+class StrikeDetector:
+    """
+    流式击打检测器：每个传感器一个实例，每个样本 O(1)。
+    加速度模长经高通去掉重力，整流平滑后与自适应阈值比较，
+    在超过阈值后的第一个回落样本处报告峰值；包络回落到阈值以下且过了不应期后才会再次触发。
+    """
+
+    def __init__(self, sensor_id=0, threshold_k=THRESHOLD_K, min_threshold=MIN_THRESHOLD,
+                 refractory_sec=REFRACTORY_SEC, velocity_full_scale=VELOCITY_FULL_SCALE):
+        self.sensor_id = sensor_id
+        self.threshold_k = threshold_k
+        self.min_threshold = min_threshold
+        self.refractory_sec = refractory_sec
+        self.velocity_full_scale = velocity_full_scale
+
+        self.first_time = None
+        self.last_time = None
+        self.gravity = None  # 加速度模长的缓变分量
+        self.envelope = 0.0  # 整流平滑后的动态分量
+        self.noise_mean = 0.0
+        self.noise_dev = 0.0
+        self.peak_value = None  # 当前候选峰值（超过阈值时开始跟踪）
+        self.peak_time = None
+        self.above_threshold = False  # 包络是否仍处于阈值之上（回落前不再触发）
+        self.above_since = None  # 包络开始高于阈值的时刻
+        self.last_strike_time = None
+        self.strike_count = 0
+
+    @staticmethod
+    def _alpha(dt, tau):
+        return 1.0 - math.exp(-dt / tau)
+
+    def threshold(self):
+        return max(self.min_threshold, self.noise_mean + self.threshold_k * self.noise_dev)
+
+    def update(self, accel, t: float):
+        """输入一个加速度样本及其时间（秒），检测到击打时返回 Strike，否则返回 None"""
+        ax, ay, az = accel
+        magnitude = math.sqrt(ax * ax + ay * ay + az * az)
+        if self.last_time is None:
+            self.first_time = self.last_time = t
+            self.gravity = magnitude
+            return None
+        dt = min(max(t - self.last_time, 0.0), MAX_DT)
+        self.last_time = t
+
+        # 高通：减去缓变分量；再整流平滑得到包络
+        self.envelope += self._alpha(dt, SMOOTH_TAU) * (abs(magnitude - self.gravity) - self.envelope)
+        value = self.envelope
+        threshold = self.threshold()
+
+        if t - self.first_time < WARMUP_SEC:
+            self.gravity += self._alpha(dt, WARMUP_GRAVITY_TAU) * (magnitude - self.gravity)
+            self._update_noise(value, dt)
+            return None
+
+        if self.peak_value is not None:
+            if value >= self.peak_value:
+                self.peak_value, self.peak_time = value, t
+                return None
+            # 峰值后第一个回落样本：报告击打
+            strike = self._emit()
+            self.peak_value = None
+            self.above_threshold = value > threshold
+            self.above_since = t
+            return strike
+
+        if value > threshold:
+            in_refractory = (self.last_strike_time is not None
+                             and t - self.last_strike_time < self.refractory_sec)
+            if not self.above_threshold and not in_refractory:
+                self.peak_value, self.peak_time = value, t
+            if not self.above_threshold:
+                self.above_since = t
+            self.above_threshold = True
+            if t - self.above_since > MAX_STRIKE_SEC:
+                self.gravity += self._alpha(dt, GRAVITY_TAU) * (magnitude - self.gravity)
+            return None
+        self.above_threshold = False
+
+        # 仅在静止段更新重力分量与噪声统计，避免击打本身抬高基线和阈值
+        self.gravity += self._alpha(dt, GRAVITY_TAU) * (magnitude - self.gravity)
+        self._update_noise(value, dt)
+        return None
+
+    def _update_noise(self, value, dt):
+        alpha = self._alpha(dt, NOISE_TAU)
+        self.noise_mean += alpha * (value - self.noise_mean)
+        self.noise_dev += alpha * (abs(value - self.noise_mean) - self.noise_dev)
+
+    def _emit(self):
+        strength = self.peak_value - self.noise_mean
+        velocity = int(round(127 * strength / self.velocity_full_scale))
+        velocity = max(1, min(127, velocity))
+        self.last_strike_time = self.peak_time
+        self.strike_count += 1
+        return Strike(self.sensor_id, self.peak_time, strength, velocity)
@@ -1,8 +1,15 @@
 import asyncio
+import os
 import time
-from music_continuator_new import MusicContinuator
+from music_continuator_new import MusicContinuator, DRUM_ID_TO_MIDI
 from sensor_connect import SensorConnector
-from drum_aware import DrumAwareProb
+from drum_aware import DrumAwareProb, CORRECTION_PREGEN
+from session_log import SessionRecorder
+from hit_pipeline import HitPipeline
+from hit_store import HitStore
+from generation_worker import GenerationWorker
+from model_registry import print_startup_stats
+from latency_trace import TRACER, STAGE_WORKER, STAGE_CORRECTED, STAGE_CONTINUATOR
 
 # ================== 配置 ==================
 SENSOR_DRUM_MAP = {
@@ -14,44 +21,78 @@ SENSOR_DRUM_MAP = {
     5: "cowbell"     # R_ANKLE
 }
 
-SENSOR_COOLDOWN_TIME = 0.45  # 秒
 MUSIC_CONTINUATOR_MODEL_PATH = "/home/kong/PycharmProjects/Playdrum/drum_kit_rnn.mag"
 DRUM_MODEL_PATH = "/home/kong/PycharmProjects/Playdrum/drum_kit_rnn.mag"
+SESSION_LOG_PATH = None  # 设置为文件路径即可录制原始BLE数据包，供 replay_session.py 离线回放
+LATENCY_TRACE_PATH = None  # 设置为文件路径即可开启逐击打延迟追踪，退出时导出Chrome trace JSON
+SESSION_MIDI_PATH = None  # 设置为文件路径即可在退出时把本次输入的击打导出为MIDI
+DRUM_CORRECTION_MODE = CORRECTION_PREGEN  # 改为 CORRECTION_STEP 使用单步打分修正（逐击打前向一步RNN）
+USE_GENERATION_WORKER = os.environ.get("PLAYDRUM_GENERATION_WORKER") == "1"  # 在独立进程中运行 Drums RNN 生成
+DRUM_CORRECTION_SEED = int(os.environ["PLAYDRUM_SEED"]) if os.environ.get("PLAYDRUM_SEED") else None  # 固定修正采样的随机种子
 
 # ================== 初始化 ==================
-music_continuator = MusicContinuator(MUSIC_CONTINUATOR_MODEL_PATH)
-drum_aware = DrumAwareProb(DRUM_MODEL_PATH, threshold=0.3)
-# 跟踪每个传感器的上次触发时间
-last_sensor_trigger_time = {}
-# ================== 传感器回调 ==================
-def sensor_moved(sensor_id: int, sensor_name: str, timestamp: float, accel=None):
-    current_time = time.time()
-    # 冷却检测
-    if sensor_id in last_sensor_trigger_time and current_time - last_sensor_trigger_time[sensor_id] < SENSOR_COOLDOWN_TIME:
-        return
-    last_sensor_trigger_time[sensor_id] = current_time
+startup_start = time.perf_counter()
+if LATENCY_TRACE_PATH:
+    TRACER.enable()
+# 生成进程须在加载模型和音频之前启动
+generation_worker = GenerationWorker(MUSIC_CONTINUATOR_MODEL_PATH) if USE_GENERATION_WORKER else None
+# 修正后的击打只由 DrumAwareProb 写入一次，MusicContinuator 直接读取同一份历史
+hit_store = HitStore()
+music_continuator = MusicContinuator(MUSIC_CONTINUATOR_MODEL_PATH, generation_worker=generation_worker,
+                                     hit_store=hit_store)
+drum_aware = DrumAwareProb(DRUM_MODEL_PATH, threshold=0.3, generation_worker=generation_worker,
+                           correction_mode=DRUM_CORRECTION_MODE, seed=DRUM_CORRECTION_SEED, hit_store=hit_store)
+print_startup_stats("play_with_aware", startup_start)
+# ================== 击打处理（工作线程） ==================
+# 击打检测（含不应期）已在 SensorConnector 中完成，这里每次调用对应一次击打
+def process_hit(sensor_id: int, sensor_name: str, quat=None, accel=None, strike=None):
+    current_time = strike.timestamp if strike else time.time()
+    velocity = strike.velocity if strike else None
+    trace_id = strike.trace_id if strike else None
+    TRACER.stamp(trace_id, STAGE_WORKER)
     drum = SENSOR_DRUM_MAP.get(sensor_id)
     if drum is None:
         return
     # 校正
-    corrected_drum = drum_aware.input_hit(drum, current_time)
+    with hit_pipeline.stage("correction"):
+        corrected_drum = drum_aware.input_hit(drum, current_time, velocity)
+    TRACER.stamp(trace_id, STAGE_CORRECTED)
     # 输入到 MusicContinuator（生成连贯鼓点）
-    music_continuator.input_a_hit(corrected_drum, current_time)
+    with hit_pipeline.stage("continuator"):
+        music_continuator.input_a_hit(corrected_drum, current_time, velocity, record=False)
+    TRACER.stamp(trace_id, STAGE_CONTINUATOR)
     # 即时播放（由 DrumPlayer 内部线程管理并发）
-    music_continuator._safe_play(corrected_drum)
-    print(f"Sensor {sensor_name} (ID={sensor_id}) triggered. Drum={drum}, Corrected={corrected_drum}")
+    with hit_pipeline.stage("play"):
+        music_continuator._safe_play(corrected_drum, velocity, trace_id)
+    print(f"Sensor {sensor_name} (ID={sensor_id}) triggered. Drum={drum}, Corrected={corrected_drum}, Velocity={velocity}")
+# ================== 传感器回调（BLE事件循环） ==================
+# 事件循环中只打时间戳并入队，重活交给工作线程，避免阻塞其他传感器的通知
+hit_pipeline = HitPipeline(process_hit)
+sensor_moved = hit_pipeline.submit
 # ================== 主 asyncio 循环 ==================
 async def main():
     # 初始化传感器连接器
-    connector = SensorConnector()
+    recorder = SessionRecorder(SESSION_LOG_PATH) if SESSION_LOG_PATH else None
+    connector = SensorConnector(recorder=recorder)
     # 连接所有传感器，并传入回调函数
-    await connector.connect_all(sensor_moved)
+    try:
+        await connector.connect_all(sensor_moved)
+    finally:
+        if recorder is not None:
+            recorder.close()
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("[DEBUG] 停止播放...")
+        hit_pipeline.print_stats()
+        drum_aware.print_stats()
+        TRACER.shutdown(LATENCY_TRACE_PATH)
+        if SESSION_MIDI_PATH:
+            music_continuator.hit_store.save_midi(SESSION_MIDI_PATH, DRUM_ID_TO_MIDI)
         music_continuator.stop()
+        if generation_worker is not None:
+            generation_worker.close()
 
 
 
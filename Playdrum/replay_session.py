@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import importlib
+import os
+import time
+from sensor_connect import SENSOR_MAP, SensorConnector
+from session_log import SessionReplayer
+from hit_pipeline import percentile
+from latency_trace import TRACER
+
+# ================== 配置 ==================
+PLAY_MODES = ("with_aware", "without_aware", "with_sheet")
+
+
+# 离线回放录制的会话，测量鼓点管线的吞吐与回调耗时
+async def replay(mode: str, path: str, speed, trace_path=None):
+    if trace_path:
+        TRACER.enable()
+    play_module = importlib.import_module(f"play_{mode}")
+    replayer = SessionReplayer(path, SENSOR_MAP, speed=speed)
+    # 回放的不是真实设备，不读写设备地址缓存
+    connector = SensorConnector(client_factory=replayer.client_factory, device_cache_path=None)
+    callback_ms = []
+
+    def timed_callback(*args):
+        start = time.perf_counter()
+        play_module.sensor_moved(*args)
+        callback_ms.append((time.perf_counter() - start) * 1000)
+
+    connect_task = asyncio.create_task(connector.connect_all(timed_callback, scan=False))
+    await replayer.finished.wait()
+    # 等待消费协程处理完缓冲区中剩余的数据包
+    while any(t.packet_queue for t in connector.trackers):
+        await asyncio.sleep(0.01)
+    # 等待工作线程处理完排队的击打
+    await asyncio.to_thread(play_module.hit_pipeline.wait_idle)
+    connect_task.cancel()
+    play_module.music_continuator.stop()
+
+    processed = sum(t.processed for t in connector.trackers)
+    dropped = sum(t.dropped for t in connector.trackers)
+    callback_ms.sort()
+    print(f"模式: play_{mode}")
+    print(f"处理数据包: {processed} ({processed / max(replayer.wall_time, 1e-9):,.0f} 包/秒)，溢出丢弃: {dropped}")
+    print(f"回调次数: {len(callback_ms)}")
+    print(f"回调耗时 p50={percentile(callback_ms, 50):.2f}ms "
+          f"p95={percentile(callback_ms, 95):.2f}ms "
+          f"p99={percentile(callback_ms, 99):.2f}ms "
+          f"max={callback_ms[-1] if callback_ms else 0.0:.2f}ms")
+    play_module.hit_pipeline.print_stats()
+    TRACER.shutdown(trace_path)
+    if play_module.generation_worker is not None:
+        print(f"[GenerationWorker] {play_module.generation_worker.stats()}")
+        play_module.generation_worker.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的Mocopi会话并测量鼓点管线性能")
+    parser.add_argument("log", help="SessionRecorder 录制的会话日志")
+    parser.add_argument("--mode", choices=PLAY_MODES, default="with_aware")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示全速")
+    parser.add_argument("--trace", default=None, help="开启逐击打延迟追踪并导出Chrome trace JSON到该路径")
+    parser.add_argument("--generation-worker", action="store_true", help="在独立进程中运行 Drums RNN 生成，用于对比回调抖动")
+    parser.add_argument("--seed", type=int, default=None, help="固定鼓点修正的随机种子，使多次回放的修正结果可比对")
+    args = parser.parse_args()
+    if args.generation_worker:
+        os.environ["PLAYDRUM_GENERATION_WORKER"] = "1"  # 须在导入 play_* 脚本之前设置
+    if args.seed is not None:
+        os.environ["PLAYDRUM_SEED"] = str(args.seed)
+    asyncio.run(replay(args.mode, args.log, args.speed or None, args.trace))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
 import asyncio
+import collections
+import functools
+import json
+import os
+import random
 import struct
 import math
+import time
+import numpy as np
 from bleak import BleakClient
 from bleak import BleakScanner
 from bleak.backends.device import BLEDevice
+from onset_detector import StrikeDetector
+from clock_sync import DeviceClock
+from latency_trace import TRACER
 
 # 传感器名称与MAC地址的映射
 SENSOR_MAP = {
@@ -19,6 +29,40 @@ SENSOR_MAP = {
 DATA_CHAR_UUID = "25047e64-657c-4856-afcf-e315048a965b"
 CMD_CHAR_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
 
+# 每台传感器的数据包环形缓冲区
+PACKET_QUEUE_SIZE = 64  # 缓冲区容量（包）
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 缓冲区满时丢弃最旧的包
+OVERFLOW_LATEST = "latest"  # 只保留最新的包（未消费的旧包全部合并丢弃）
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_LATEST)
+QUEUE_STATS_INTERVAL = 10  # 队列统计输出间隔（秒）
+
+# 连接与扫描策略
+DEVICE_CACHE_PATH = "sensor_cache.json"  # 成功连接过的设备地址缓存
+SCAN_TIMEOUT = 10.0  # 定向扫描超时（秒），所有目标设备出现后提前结束
+RETRY_SCAN_TIMEOUT = 5.0  # 单台设备重试前的定向扫描超时（秒）
+CONNECT_TIMEOUT = 10.0  # 使用扫描得到的BLEDevice连接的超时（秒）
+DIRECT_CONNECT_TIMEOUT = 5.0  # 按缓存地址直连的超时（秒）
+MAX_CONCURRENT_CONNECTS = 3  # 同时进行的连接尝试上限
+RETRY_DELAY = 2.0  # 重试基础间隔（秒）
+RETRY_JITTER = 1.0  # 重试间隔的随机抖动上限（秒），避免多台设备同时重试
+RECONNECT_BASE_DELAY = 0.5  # 断线重连的初始退避（秒）
+RECONNECT_MAX_DELAY = 10.0  # 断线重连的最大退避（秒）
+
+# monotonic时间到time.time()的偏移，用于把包到达时间换算成与播放端一致的绝对时间
+WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
+# Mocopi数据包布局：8字节包头，int16四元数(w,x,y,z)，float16加速度(x,y,z)
+PACKET_SIZE = 30  # 解析所需的最小包长（字节）
+QUAT_SCALE = 8192.0
+_PACKET_STRUCT = struct.Struct('<8x4h8x3e')
+_HEADER_STRUCT = struct.Struct('<Q')
+
+# 设备时钟来源：包头中的设备时间，或主机端包序号（包头不可用时的后备）
+CLOCK_SOURCE_HEADER = "header"
+CLOCK_SOURCE_PCOUNTER = "pcounter"
+CLOCK_MAX_HEADER_RESETS = 5  # 包头时间连续回退（期间模型一次都没能完成预热）超过该次数则认为不可用，改用包序号
+CLOCK_HEADER_RECOVER_PACKETS = 500  # 改用包序号后，包头时间连续递增该包数则切回包头时间
+
 # 绕X轴旋转四元数并交换Y与Z轴
 def rotate_quaternion(quat, axis, angle_degrees):
     # 将角度转换为弧度
@@ -37,44 +81,186 @@ def rotate_quaternion(quat, axis, angle_degrees):
         w1*z2 + x1*y2 - y1*x2 + z1*w2,
     )
 
-# 提取Mocopi格式的四元数和加速度
+# 预计算 原始int16四元数 -> 最终四元数 的线性变换矩阵
+# （包含缩放、Y取反、绕X轴旋转90°以及Y/Z交换）
+def _build_quat_matrix():
+    columns = []
+    for basis in ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1)):
+        qw, qx, qy, qz = (v / QUAT_SCALE for v in basis)
+        rotated = rotate_quaternion((qw, qx, -qy, qz), (1, 0, 0), 90)
+        columns.append((rotated[0], rotated[1], rotated[3], rotated[2]))
+    return tuple(zip(*columns))  # 按行存储
+
+QUAT_MATRIX = _build_quat_matrix()
+_QUAT_MATRIX_T = np.array(QUAT_MATRIX, dtype=np.float64).T
+
+# 结构化dtype，直接以视图方式读取连续缓冲区中的N个数据包
+@functools.lru_cache(maxsize=None)
+def packet_dtype(packet_size=PACKET_SIZE):
+    if packet_size < PACKET_SIZE:
+        raise ValueError(f"数据包长度至少为 {PACKET_SIZE} 字节: {packet_size}")
+    return np.dtype({
+        "names": ["header", "quat", "accel"],
+        "formats": ["<u8", ("<i2", 4), ("<f2", 3)],
+        "offsets": [0, 8, 24],
+        "itemsize": packet_size,
+    })
+
+# 批量解析：buffer为N个定长数据包拼接而成，返回 (N,4) 四元数与 (N,3) 加速度
+def decode_packets(buffer, packet_size=PACKET_SIZE):
+    packets = np.frombuffer(buffer, dtype=packet_dtype(packet_size))
+    quats = packets["quat"] @ _QUAT_MATRIX_T
+    accels = packets["accel"].astype(np.float64)
+    return quats, accels
+
+# 读取包头（data[0:8]）中随设备时钟单调递增的计数，作为设备时间
+def parse_device_ticks(data: bytes):
+    return _HEADER_STRUCT.unpack_from(data)[0]
+
+# 提取Mocopi格式的四元数和加速度（单包版本，与decode_packets共用预计算矩阵）
 def convert_quaternion_and_accel(data: bytes):
-    if len(data) < 30:
+    if len(data) < PACKET_SIZE:
         return None, None
-    def to_float(b):
-        raw = int.from_bytes(b, byteorder='little', signed=True)
-        return raw / 8192.0
-    qw = to_float(data[8:10])
-    qx = to_float(data[10:12])
-    qy = to_float(data[12:14])
-    qz = to_float(data[14:16])
-    original_quat = (qw, qx, -qy, qz)
-    rotated_quat = rotate_quaternion(original_quat, (1, 0, 0), 90)
-    final_quat = (
-        rotated_quat[0],   # w
-        rotated_quat[1],   # x
-        rotated_quat[3],   # z -> y
-        rotated_quat[2],   # y -> z
-    )
-    ax = struct.unpack('<e', data[24:26])[0]
-    ay = struct.unpack('<e', data[26:28])[0]
-    az = struct.unpack('<e', data[28:30])[0]
+    qw, qx, qy, qz, ax, ay, az = _PACKET_STRUCT.unpack_from(data)
+    final_quat = tuple(m0*qw + m1*qx + m2*qy + m3*qz for m0, m1, m2, m3 in QUAT_MATRIX)
     return final_quat, (ax, ay, az)
 
+# 读取设备地址缓存：{mac: {"name": ..., "last_connected": ...}}
+def load_device_cache(path=DEVICE_CACHE_PATH):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"读取设备缓存 {path} 失败: {e}")
+        return {}
+
+# 写入设备地址缓存
+def save_device_cache(cache, path=DEVICE_CACHE_PATH):
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2, ensure_ascii=False)
+    except OSError as e:
+        print(f"写入设备缓存 {path} 失败: {e}")
+
 # 单台传感器管理类
 class SingleTracker:
-    def __init__(self, mac_or_device, sensor_id=0, name="Unknown"):
+    def __init__(self, mac_or_device, sensor_id=0, name="Unknown",
+                 queue_size=PACKET_QUEUE_SIZE, overflow_policy=OVERFLOW_DROP_OLDEST):
         self.mac = mac_or_device.address if isinstance(mac_or_device, BLEDevice) else mac_or_device
         self.device = mac_or_device if isinstance(mac_or_device, BLEDevice) else None
         self.name = name
         self.client = None
         self.pcounter = 0
         self.sensor_id = sensor_id
-        self.last_quat = None  # 存储上一次四元数值，用于变化检测
+        self.last_quat = None  # 存储上一次四元数值
+        self.onset_detector = StrikeDetector(sensor_id)  # 基于加速度的击打检测
+        self.clock = DeviceClock()  # 设备时间 -> 主机时间 的在线模型，用于去除到达抖动
+        self.clock_source = CLOCK_SOURCE_HEADER
+        self.last_header_ticks = None  # 使用包序号时仍跟踪包头时间，判断能否切回
+        self.header_increasing = 0  # 包头时间连续递增的包数
+        self.timings = {}  # 各连接阶段耗时（ms）：scan/connect/pair/notify_start/first_packet
+        self.stream_started_at = None  # 发送流启动命令的时刻（perf_counter）
+
+        # 断线检测与重连统计
+        self.disconnected = asyncio.Event()  # 由客户端的断开回调触发
+        self.closing = False  # 主动断开时不触发重连
+        self.disconnected_at = None  # 断开时刻（perf_counter）
+        self.last_packet_time = None  # 最近一个包的对齐时间（秒）
+        self.packet_interval = None  # 平均包间隔（秒），用于估算断线期间丢失的包
+        self.gap_start_time = None  # 断线前最后一个包的时间，收到重连后的第一个包时结算丢包
+        self.reconnect_count = 0
+        self.reconnect_latency_ms = []
+        self.packets_lost = 0
         self.is_connected = False
 
+        # 数据包环形缓冲区，由单个常驻消费协程处理
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow_policy}")
+        self.overflow_policy = overflow_policy
+        self.packet_queue = collections.deque(maxlen=queue_size)
+        self.packet_ready = asyncio.Event()
+        self.consumer_task = None
+        self.enqueued = 0  # 入队包数
+        self.dropped = 0  # 因溢出丢弃的包数
+        self.processed = 0  # 已处理包数
+
+    # BLE通知回调中调用：记录到达时间后入队并唤醒消费协程，不创建新任务
+    # 回放时由回放客户端传入录制时的到达时间（arrival_ns）
+    def push_packet(self, data: bytes, arrival_ns=None):
+        if self.overflow_policy == OVERFLOW_LATEST:
+            self.dropped += len(self.packet_queue)
+            self.packet_queue.clear()
+        elif len(self.packet_queue) == self.packet_queue.maxlen:
+            self.dropped += 1  # deque满时append会自动挤掉最旧的包
+        self.packet_queue.append((time.monotonic_ns() if arrival_ns is None else arrival_ns, data))
+        self.enqueued += 1
+        self.packet_ready.set()
+
+    # 用设备时钟模型把包的到达时间换算为去抖后的主机时间（ns）
+    def align_timestamp(self, data: bytes, arrival_ns: int) -> int:
+        if self.clock_source == CLOCK_SOURCE_HEADER and self.clock.consecutive_resets > CLOCK_MAX_HEADER_RESETS:
+            print(f"[{self.name}] 包头时间不递增，改用包序号对齐时钟")
+            self.clock_source = CLOCK_SOURCE_PCOUNTER
+            self.last_header_ticks = None
+            self.header_increasing = 0
+            self.clock.restart()
+        if self.clock_source == CLOCK_SOURCE_HEADER:
+            device_ticks = parse_device_ticks(data)
+        else:
+            device_ticks = self.pcounter
+            header_ticks = parse_device_ticks(data)
+            if self.last_header_ticks is not None and header_ticks < self.last_header_ticks:
+                self.header_increasing = 0
+            elif self.last_header_ticks is not None and header_ticks > self.last_header_ticks:
+                self.header_increasing += 1
+            self.last_header_ticks = header_ticks
+            if self.header_increasing >= CLOCK_HEADER_RECOVER_PACKETS:
+                print(f"[{self.name}] 包头时间恢复稳定，切回包头时间对齐时钟")
+                self.clock_source = CLOCK_SOURCE_HEADER
+                self.clock.restart()
+                device_ticks = header_ticks
+        return self.clock.update(device_ticks, arrival_ns)
+
+    # BleakClient 的断开回调：立即标记断线并唤醒重连监控
+    def on_disconnect(self, client):
+        if client is not self.client:
+            return  # 已被替换的旧客户端
+        self.is_connected = False
+        if not self.closing:
+            self.disconnected_at = time.perf_counter()
+            self.gap_start_time = self.last_packet_time
+            self.disconnected.set()
+
+    # 记录包时间：更新平均包间隔，并在断线恢复后的第一个包处估算丢包数
+    def note_packet_time(self, t: float):
+        if self.gap_start_time is not None:
+            if self.packet_interval:
+                lost = max(0, int(round((t - self.gap_start_time) / self.packet_interval)) - 1)
+                self.packets_lost += lost
+                print(f"[{self.name}] 断线期间约丢失 {lost} 个包")
+            self.gap_start_time = None
+        elif self.last_packet_time is not None and t > self.last_packet_time:
+            dt = t - self.last_packet_time
+            self.packet_interval = dt if self.packet_interval is None else self.packet_interval + 0.05 * (dt - self.packet_interval)
+        self.last_packet_time = t
+
+    # 队列统计
+    def queue_stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "pending": len(self.packet_queue),
+            "clock_jitter_ms": self.clock.jitter * 1000,
+            "reconnects": self.reconnect_count,
+            "packets_lost": self.packets_lost,
+        }
+
     # 断开连接
     async def disconnect(self):
+        self.closing = True
         if self.client and self.client.is_connected:
             try:
                 await self.client.disconnect()
@@ -85,94 +271,267 @@ class SingleTracker:
 
 # 传感器连接管理类
 class SensorConnector:
-    def __init__(self):
+    def __init__(self, queue_size=PACKET_QUEUE_SIZE, overflow_policy=OVERFLOW_DROP_OLDEST,
+                 client_factory=BleakClient, recorder=None, device_cache_path=DEVICE_CACHE_PATH,
+                 max_concurrent_connects=MAX_CONCURRENT_CONNECTS, sensor_map=None):
+        """
+        :param client_factory: 创建BLE客户端的工厂（默认BleakClient，回放时替换为SessionReplayer.client_factory）
+        :param recorder: 可选的SessionRecorder，录制所有原始数据包
+        :param device_cache_path: 设备地址缓存文件，None 表示不使用缓存
+        :param max_concurrent_connects: 同时进行的连接尝试上限
+        :param sensor_map: 传感器名称到MAC地址的映射（默认SENSOR_MAP）
+        """
+        self.client_factory = client_factory
+        self.recorder = recorder
+        self.device_cache_path = device_cache_path
+        self.device_cache = {}
+        self.connect_semaphore = asyncio.Semaphore(max_concurrent_connects)
+        self.scan_lock = asyncio.Lock()
+        self.startup_time = None  # connect_all 开始的时刻（perf_counter）
+        self.first_hit_ms = None  # 启动到第一次击打的耗时
         self.trackers = []
-        self.sensor_map = SENSOR_MAP
+        self.sensor_map = sensor_map or SENSOR_MAP
         for i, (name, mac) in enumerate(self.sensor_map.items()):
-            self.trackers.append(SingleTracker(mac, sensor_id=i, name=name))
+            self.trackers.append(SingleTracker(mac, sensor_id=i, name=name,
+                                               queue_size=queue_size, overflow_policy=overflow_policy))
 
-    # 通知处理函数（当数据变化时调用回调，并传入current_quat）
-    async def notification_handler(self, _, data: bytes, tracker: SingleTracker, callback):
+    # 通知处理函数（检测到击打时调用回调，并传入current_quat、accel与Strike）
+    async def notification_handler(self, _, data: bytes, tracker: SingleTracker, callback, arrival_ns=None):
         try:
+            if arrival_ns is None:
+                arrival_ns = time.monotonic_ns()
+            if self.recorder is not None:
+                self.recorder.record(tracker.sensor_id, arrival_ns, data)
             quat, accel = convert_quaternion_and_accel(data)
             if quat is None or accel is None:
                 return
-            w, x, y, z = quat
             tracker.pcounter += 1
+            tracker.last_quat = quat
+            if "first_packet" not in tracker.timings:
+                self.record_first_packet(tracker)
 
-            # 变化检测：阈值0.01，若四元数分量变化超过阈值则调用回调
-            current_quat = (w, x, y, z)
-            if tracker.last_quat is None or any(abs(current_quat[i] - tracker.last_quat[i]) > 0.03 for i in range(4)):
-                callback(tracker.sensor_id, tracker.name, current_quat, accel)
-                tracker.last_quat = current_quat
+            # 击打检测：以设备时钟对齐后的主机时间（换算为time.time()）作为样本时间
+            sample_time = tracker.align_timestamp(data, arrival_ns) / 1e9 + WALL_CLOCK_OFFSET
+            tracker.note_packet_time(sample_time)
+            strike = tracker.onset_detector.update(accel, sample_time)
+            if strike is not None:
+                if self.first_hit_ms is None and self.startup_time is not None:
+                    self.first_hit_ms = (time.perf_counter() - self.startup_time) * 1000
+                    print(f"启动到第一次击打耗时: {self.first_hit_ms:.0f}ms")
+                if TRACER.enabled:
+                    strike = strike._replace(trace_id=TRACER.begin(tracker.sensor_id, arrival_ns))
+                callback(tracker.sensor_id, tracker.name, quat, accel, strike)
         except Exception as e:
             print(f"{tracker.name} ({tracker.mac}) 的通知处理出错: {e}")
 
-    # 保持连接的任务
-    async def maintain_connection(self, tracker: SingleTracker):
-        print(f"正在为 {tracker.name} ({tracker.mac}) 保持连接 ...")
+    # 常驻消费协程：依次处理环形缓冲区中的数据包
+    async def consume_packets(self, tracker: SingleTracker, callback):
+        while True:
+            await tracker.packet_ready.wait()
+            tracker.packet_ready.clear()
+            while tracker.packet_queue:
+                arrival_ns, data = tracker.packet_queue.popleft()
+                await self.notification_handler(None, data, tracker, callback, arrival_ns)
+                tracker.processed += 1
+
+    # 启动消费协程（每台传感器只启动一次，重连时复用）
+    def start_consumer(self, tracker: SingleTracker, callback):
+        if tracker.consumer_task is None or tracker.consumer_task.done():
+            tracker.consumer_task = asyncio.create_task(self.consume_packets(tracker, callback))
+
+    # 输出所有传感器的队列统计
+    def print_queue_stats(self):
+        for t in self.trackers:
+            stats = t.queue_stats()
+            print(f"[{t.name}] 入队={stats['enqueued']} 丢弃={stats['dropped']} "
+                  f"已处理={stats['processed']} 待处理={stats['pending']} "
+                  f"到达抖动={stats['clock_jitter_ms']:.2f}ms "
+                  f"重连={stats['reconnects']} 断线丢包={stats['packets_lost']}")
+
+    # 连接监控任务：等待断开回调，断线后立即重连（其他传感器的数据流不受影响）
+    async def supervise_connection(self, tracker: SingleTracker, callback):
+        print(f"正在为 {tracker.name} ({tracker.mac}) 监控连接 ...")
         try:
             while True:
-                await asyncio.sleep(1)
+                await tracker.disconnected.wait()
+                print(f"{tracker.name} ({tracker.mac}) 连接断开，开始重连")
+                await self.reconnect_tracker(tracker, callback)
         except Exception as e:
-            print(f"{tracker.name} 的连接维护出错: {e}")
+            print(f"{tracker.name} 的连接监控出错: {e}")
         finally:
             await tracker.disconnect()
 
-    # 扫描设备（获取真实BLEDevice对象）
-    async def scan_devices(self):
-        print("正在扫描设备...")
-        devices = await BleakScanner.discover(timeout=10.0)
+    # 断线重连：带抖动的指数退避，恢复通知与流启动命令，并记录重连耗时
+    async def reconnect_tracker(self, tracker: SingleTracker, callback):
+        delay = RECONNECT_BASE_DELAY
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self.connect_semaphore:
+                    await self.open_stream(tracker, callback, attempt)
+                latency_ms = (time.perf_counter() - tracker.disconnected_at) * 1000
+                tracker.reconnect_count += 1
+                tracker.reconnect_latency_ms.append(latency_ms)
+                print(f"[{tracker.name} ({tracker.mac})] 重连成功，耗时 {latency_ms:.0f}ms")
+                return
+            except Exception as e:
+                print(f"[重连 {attempt}] {tracker.name} ({tracker.mac}) 出错: {e}")
+                tracker.is_connected = False
+                await self.close_client(tracker)
+            wait = delay * random.uniform(0.5, 1.0)
+            print(f"{wait:.1f}秒后重连...")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    # 清理连接失败后残留的客户端
+    @staticmethod
+    async def close_client(tracker: SingleTracker):
+        client = tracker.client
+        tracker.client = None
+        if client is not None and client.is_connected:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                print(f"清理 {tracker.name} ({tracker.mac}) 的连接时出错: {e}")
+
+    # 记录阶段耗时（ms）
+    @staticmethod
+    def mark_phase(tracker: SingleTracker, phase: str, started_at: float):
+        tracker.timings[phase] = (time.perf_counter() - started_at) * 1000
+
+    # 记录第一个数据包，所有传感器都收到数据后输出启动耗时汇总
+    def record_first_packet(self, tracker: SingleTracker):
+        if tracker.stream_started_at is not None:
+            self.mark_phase(tracker, "first_packet", tracker.stream_started_at)
+        else:
+            tracker.timings["first_packet"] = 0.0
+        if self.startup_time is not None:
+            tracker.timings["startup_to_first_packet"] = (time.perf_counter() - self.startup_time) * 1000
+        if self.startup_time is not None and all("first_packet" in t.timings for t in self.trackers):
+            self.print_startup_timings()
+
+    # 输出各传感器的启动阶段耗时
+    def print_startup_timings(self):
+        print("===== 启动耗时 (ms) =====")
+        for t in self.trackers:
+            phases = " ".join(f"{phase}={t.timings[phase]:.0f}"
+                              for phase in ("scan", "connect", "pair", "notify_start", "first_packet",
+                                            "startup_to_first_packet")
+                              if phase in t.timings)
+            print(f"[{t.name}] {phases}")
+
+    # 定向扫描（获取真实BLEDevice对象），所有目标设备出现后立即结束
+    async def scan_devices(self, wanted_macs=None, timeout=SCAN_TIMEOUT):
+        wanted = {mac.replace(':', '').lower(): mac for mac in (wanted_macs or self.sensor_map.values())}
+        mac_to_name = {mac: name for name, mac in self.sensor_map.items()}
         found_devices = {}
-        for device in devices:
-            if device.name and device.name.startswith("QM-SS1"):
-                # 匹配MAC地址（忽略大小写和冒号）
-                clean_mac = device.address.replace(':', '').lower()
-                for name, mac in self.sensor_map.items():
-                    if clean_mac == mac.replace(':', '').lower():
-                        found_devices[mac] = device
-                        print(f"找到设备 {device.name} 在 {device.address}，对应 {name}")
+        all_found = asyncio.Event()
+
+        def on_detection(device, advertisement_data):
+            # 匹配MAC地址（忽略大小写和冒号）
+            mac = wanted.get(device.address.replace(':', '').lower())
+            if mac is None or mac in found_devices:
+                return
+            found_devices[mac] = device
+            print(f"找到设备 {device.name or advertisement_data.local_name} 在 {device.address}，对应 {mac_to_name.get(mac)}")
+            if len(found_devices) == len(wanted):
+                all_found.set()
+
+        async with self.scan_lock:
+            print(f"正在扫描设备（目标 {len(wanted)} 台）...")
+            started_at = time.perf_counter()
+            async with BleakScanner(detection_callback=on_detection):
+                try:
+                    await asyncio.wait_for(all_found.wait(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"扫描超时，未找到 {len(wanted) - len(found_devices)} 台设备")
+            for t in self.trackers:
+                if t.mac in found_devices:
+                    t.device = found_devices[t.mac]
+                    self.mark_phase(t, "scan", started_at)
         return found_devices
 
-    # 连接单台传感器，无限重试直到成功
-    async def connect_tracker_once(self, tracker: SingleTracker, callback):
+    # 记录成功连接的设备地址，下次启动时直接按地址连接；
+    # 只有新设备或名称变化时才写文件（重连不写），写入放到线程中，不阻塞事件循环上的其他传感器
+    async def remember_device(self, tracker: SingleTracker):
+        if not self.device_cache_path:
+            return
+        known = self.device_cache.get(tracker.mac)
+        self.device_cache[tracker.mac] = {"name": tracker.name, "last_connected": time.time()}
+        if known is not None and known.get("name") == tracker.name:
+            return
+        await asyncio.to_thread(save_device_cache, dict(self.device_cache), self.device_cache_path)
+
+    # 建立连接、配对、启动通知并发送流启动命令
+    async def open_stream(self, tracker: SingleTracker, callback, attempt):
+        tracker.closing = False
+        tracker.disconnected.clear()
+        # 重连后设备时间可能不连续：主动重建时钟模型，不计入包头时间的回退次数
+        tracker.clock.restart()
+        # 使用device对象（如果可用）或MAC地址直连
+        timeout = CONNECT_TIMEOUT if tracker.device else DIRECT_CONNECT_TIMEOUT
+        started_at = time.perf_counter()
+        client = self.client_factory(tracker.device if tracker.device else tracker.mac, timeout=timeout,
+                                     disconnected_callback=tracker.on_disconnect)
+        await client.connect()
+        self.mark_phase(tracker, "connect", started_at)
+        tracker.client = client  # 存储client引用
+        tracker.is_connected = True
+
+        # 尝试配对（可选）
+        started_at = time.perf_counter()
+        try:
+            if hasattr(client, "pair"):
+                await client.pair(protection_level=2)
+                print(f"尝试为 {tracker.name} ({tracker.mac}) 配对")
+        except Exception as pair_err:
+            print(f"配对不支持或失败: {pair_err}")
+        self.mark_phase(tracker, "pair", started_at)
+
+        print(f"[尝试 {attempt}] 已连接到 {tracker.name} ({tracker.mac}) (传感器ID={tracker.sensor_id})")
+        self.start_consumer(tracker, callback)
+        started_at = time.perf_counter()
+        await client.start_notify(
+            DATA_CHAR_UUID,
+            lambda s, d, arrival_ns=None: tracker.push_packet(d, arrival_ns)
+        )
+        print(f"[{tracker.name} ({tracker.mac})] 通知已启动")
+        await client.write_gatt_char(
+            CMD_CHAR_UUID,
+            bytearray([0x7e, 0x03, 0x18, 0xd6, 0x01, 0x00, 0x00])
+        )
+        self.mark_phase(tracker, "notify_start", started_at)
+        tracker.stream_started_at = time.perf_counter()
+        print(f"[{tracker.name} ({tracker.mac})] 已发送流启动命令")
+
+    # 连接单台传感器，带抖动重试直到成功；scan_task 不为空时先等待定向扫描结果
+    async def connect_tracker_once(self, tracker: SingleTracker, callback, scan=True, scan_task=None):
+        if scan_task is not None:
+            try:
+                await scan_task
+            except Exception as e:
+                print(f"定向扫描出错: {e}")
         attempt = 0
         while True:
             attempt += 1
             print(f"[尝试 {attempt}] 正在连接 {tracker.name} ({tracker.mac}) (ID={tracker.sensor_id})")
             try:
-                # 使用device对象（如果可用）或MAC地址
-                client = BleakClient(tracker.device if tracker.device else tracker.mac, timeout=10.0)
-                await client.connect()
-                tracker.client = client  # 存储client引用
-                tracker.is_connected = True
-
-                # 尝试配对（可选）
-                try:
-                    if hasattr(client, "pair"):
-                        await client.pair(protection_level=2)
-                        print(f"尝试为 {tracker.name} ({tracker.mac}) 配对")
-                except Exception as pair_err:
-                    print(f"配对不支持或失败: {pair_err}")
-
-                print(f"[尝试 {attempt}] 已连接到 {tracker.name} ({tracker.mac}) (传感器ID={tracker.sensor_id})")
-                await client.start_notify(
-                    DATA_CHAR_UUID,
-                    lambda s, d: asyncio.create_task(self.notification_handler(s, d, tracker, callback))
-                )
-                print(f"[{tracker.name} ({tracker.mac})] 通知已启动")
-                await client.write_gatt_char(
-                    CMD_CHAR_UUID,
-                    bytearray([0x7e, 0x03, 0x18, 0xd6, 0x01, 0x00, 0x00])
-                )
-                print(f"[{tracker.name} ({tracker.mac})] 已发送流启动命令")
-                asyncio.create_task(self.maintain_connection(tracker))
+                async with self.connect_semaphore:
+                    await self.open_stream(tracker, callback, attempt)
+                await self.remember_device(tracker)
+                asyncio.create_task(self.supervise_connection(tracker, callback))
                 return
             except Exception as e:
                 print(f"[尝试 {attempt}] 连接 {tracker.name} ({tracker.mac}) (ID={tracker.sensor_id}) 出错: {e}")
-                print(f"正在重试...")
-                await asyncio.sleep(2)
-            tracker.is_connected = False
+                tracker.is_connected = False
+                await self.close_client(tracker)
+            # 按地址直连失败时，先对该设备做一次定向扫描
+            if scan and tracker.device is None:
+                await self.scan_devices([tracker.mac], timeout=RETRY_SCAN_TIMEOUT)
+            delay = RETRY_DELAY + random.uniform(0, RETRY_JITTER)
+            print(f"{delay:.1f}秒后重试...")
+            await asyncio.sleep(delay)
 
     # 检查未连接的传感器并输出
     async def check_unconnected(self):
@@ -186,25 +545,30 @@ class SensorConnector:
             await asyncio.sleep(3)
 
     # 连接所有传感器
-    async def connect_all(self, callback):
+    async def connect_all(self, callback, scan=True):
         print("开始连接传感器")
-        # 先扫描设备
-        found_devices = await self.scan_devices()
-        # 更新trackers的device
-        for t in self.trackers:
-            if t.mac in found_devices:
-                t.device = found_devices[t.mac]
+        self.startup_time = time.perf_counter()
+        # 缓存中的设备按地址直连，其余设备做定向扫描（回放时无需扫描和缓存）
+        scan_task = None
+        uncached = []
+        if scan:
+            self.device_cache = load_device_cache(self.device_cache_path)
+            uncached = [t for t in self.trackers if t.mac not in self.device_cache]
+            if uncached:
+                scan_task = asyncio.create_task(self.scan_devices([t.mac for t in uncached]))
 
         # 启动检查未连接任务
         check_task = asyncio.create_task(self.check_unconnected())
 
-        # 并发启动所有连接任务
-        connect_tasks = [asyncio.create_task(self.connect_tracker_once(t, callback)) for t in self.trackers]
+        # 并发启动所有连接任务（并发数由 connect_semaphore 限制）
+        connect_tasks = [asyncio.create_task(self.connect_tracker_once(
+            t, callback, scan=scan, scan_task=scan_task if t in uncached else None)) for t in self.trackers]
         await asyncio.gather(*connect_tasks, return_exceptions=True)  # 允许异常不阻塞其他任务
 
         # 等待检查任务完成
         await check_task
 
-        # 保持运行以处理数据
+        # 保持运行以处理数据，定期输出队列统计
         while True:
-            await asyncio.sleep(1)
\ No newline at end of file
+            await asyncio.sleep(QUEUE_STATS_INTERVAL)
+            self.print_queue_stats()
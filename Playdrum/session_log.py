@@ -0,0 +1,159 @@
+import asyncio
+import mmap
+import struct
+import time
+
+# 日志文件格式：文件头 + 连续记录
+# 每条记录：sensor_id(uint8) + host_monotonic_ns(uint64) + 数据长度(uint16) + 原始字节
+LOG_MAGIC = b"MCPL"
+LOG_VERSION = 1
+_FILE_HEADER = struct.Struct('<4sH')
+_RECORD_HEADER = struct.Struct('<BQH')
+REPLAY_YIELD_EVERY = 64  # 全速回放时每隔多少包让出一次事件循环；不能超过 sensor_connect.PACKET_QUEUE_SIZE，否则单个传感器的缓冲区会溢出丢包
+
+
+# 原始BLE会话录制器：追加写入 (sensor_id, host_monotonic_ns, raw_bytes)
+class SessionRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(_FILE_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self.count = 0
+
+    def record(self, sensor_id: int, host_ns: int, data: bytes):
+        self.file.write(_RECORD_HEADER.pack(sensor_id, host_ns, len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            print(f"已录制 {self.count} 个数据包到 {self.path}")
+
+
+# 通过内存映射逐条读取会话日志，不需要把整个文件读入内存
+class SessionReader:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _FILE_HEADER.unpack_from(self.map, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            self.close()
+            raise ValueError(f"不是有效的会话日志: {path}")
+
+    # 依次产出 (sensor_id, host_ns, raw_bytes)
+    def __iter__(self):
+        offset = _FILE_HEADER.size
+        end = len(self.map)
+        while offset + _RECORD_HEADER.size <= end:
+            sensor_id, host_ns, length = _RECORD_HEADER.unpack_from(self.map, offset)
+            offset += _RECORD_HEADER.size
+            if offset + length > end:
+                break  # 录制中断导致的不完整记录
+            yield sensor_id, host_ns, self.map[offset:offset + length]
+            offset += length
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+# 替代 BleakClient 的回放客户端，由 SessionReplayer 按地址创建
+class ReplayClient:
+    def __init__(self, replayer, address, sensor_id, disconnected_callback=None):
+        self.replayer = replayer
+        self.address = address
+        self.sensor_id = sensor_id
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.notify_callback = None
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def pair(self, protection_level=None):
+        return True
+
+    async def start_notify(self, char_uuid, callback):
+        self.notify_callback = callback
+
+    async def stop_notify(self, char_uuid):
+        self.notify_callback = None
+
+    # 流启动命令：登记该传感器已就绪
+    async def write_gatt_char(self, char_uuid, data, response=None):
+        self.replayer.client_ready(self)
+
+    async def disconnect(self):
+        self.is_connected = False
+        self.notify_callback = None
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+
+# 会话回放器：以1x、Nx或全速（speed=None）把录制的数据包送回通知回调
+class SessionReplayer:
+    def __init__(self, path: str, sensor_map: dict, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.address_to_id = {mac: i for i, mac in enumerate(sensor_map.values())}
+        self.clients = {}
+        self.replay_task = None
+        self.finished = asyncio.Event()
+        self.delivered = 0  # 已送出的包数
+        self.skipped = 0  # 对应传感器未连接而跳过的包数
+        self.max_lag_ms = 0.0  # 实际送出时间相对计划时间的最大滞后
+        self.wall_time = 0.0
+
+    # 作为 SensorConnector 的 client_factory 使用
+    def client_factory(self, address_or_device, timeout=None, disconnected_callback=None, **kwargs):
+        address = getattr(address_or_device, "address", address_or_device)
+        return ReplayClient(self, address, self.address_to_id.get(address), disconnected_callback)
+
+    # 所有传感器都发出流启动命令后开始回放
+    def client_ready(self, client):
+        self.clients[client.sensor_id] = client
+        if len(self.clients) == len(self.address_to_id) and self.replay_task is None:
+            self.replay_task = asyncio.create_task(self.replay())
+
+    async def replay(self):
+        reader = SessionReader(self.path)
+        print(f"开始回放 {self.path} (速度={'全速' if not self.speed else f'{self.speed}x'})")
+        start_perf = time.perf_counter()
+        # 送给通知回调的到达时间沿用录制时的间隔（平移到回放开始时刻，不随倍速压缩），
+        # 击打检测与设备时钟在任何倍速下都看到与原始会话相同的时间轴
+        start_ns = time.monotonic_ns()
+        first_ns = None
+        since_yield = 0  # 上次让出事件循环后送出的包数
+        try:
+            for sensor_id, host_ns, data in reader:
+                if first_ns is None:
+                    first_ns = host_ns
+                if self.speed:
+                    due = start_perf + (host_ns - first_ns) / 1e9 / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        since_yield = 0
+                    else:
+                        self.max_lag_ms = max(self.max_lag_ms, -delay * 1000)
+                # 落后于计划（或全速）时定期让出，使消费协程在缓冲区写满之前处理完
+                if since_yield >= REPLAY_YIELD_EVERY:
+                    await asyncio.sleep(0)
+                    since_yield = 0
+                client = self.clients.get(sensor_id)
+                if client is None or client.notify_callback is None:
+                    self.skipped += 1
+                    continue
+                client.notify_callback(None, bytearray(data), start_ns + host_ns - first_ns)
+                self.delivered += 1
+                since_yield += 1
+            # 让消费协程处理完残留的数据包
+            await asyncio.sleep(0)
+        finally:
+            self.wall_time = time.perf_counter() - start_perf
+            reader.close()
+            self.finished.set()
+            print(f"回放结束: 送出 {self.delivered} 包，跳过 {self.skipped} 包，"
+                  f"耗时 {self.wall_time:.2f}秒，最大滞后 {self.max_lag_ms:.1f}ms")
@@ -0,0 +1,120 @@
+import threading
+import numpy as np
+from drum_rnn_stepper import DrumRnnStepper, STEP_QPM, drum_type_map
+
+# ===== 默认参数 =====
+GENERATION_TEMPERATURE = 1.2  # 与原先 generator_options 中的 temperature 一致
+
+
+class StreamingDrumGenerator:
+    """
+    流式鼓点生成：引子只编码一次。
+    用户击打通过 observe() 记录（O(1)，不在击打路径上运行模型），
+    下次生成时才把新增的击打和空步一次性前向输入，得到“已确认”的 RNN 状态；
+    stream() 从已确认状态复制出一个推测分支，逐步采样并惰性地产出生成的击打，
+    分支被丢弃时已确认状态不受影响。
+    """
+
+    def __init__(self, shared_generator, drum_to_midi: dict, temperature=GENERATION_TEMPERATURE,
+                 seed=None, qpm=STEP_QPM):
+        """
+        :param shared_generator: model_registry.SharedGenerator
+        :param drum_to_midi: 鼓件名 -> MIDI 音高
+        :param temperature: 采样温度
+        :param seed: 随机种子，便于复现
+        """
+        self.stepper = DrumRnnStepper(shared_generator, temperature)
+        self.step_ms = self.stepper.step_ms(qpm)
+        self.drum_to_midi = drum_to_midi
+        self.rng = np.random.default_rng(seed)
+
+        encoding = self.stepper.encoder_decoder._one_hot_encoding
+        self.num_classes = encoding.num_classes
+        num_types = self.num_classes.bit_length() - 1
+        _, type_drum = drum_type_map(encoding, drum_to_midi)
+        # 每个类别解码后的事件（RNN 输入）与对应的鼓件名（输出）
+        self.class_events = [encoding.decode_event(c) for c in range(self.num_classes)]
+        self.class_drums = [[type_drum[t] for t in range(num_types) if (c >> t) & 1 and t in type_drum]
+                            for c in range(self.num_classes)]
+
+        self.lock = threading.Lock()  # 保护已确认状态与待确认击打
+        self.committed_step = None  # 下一个尚未输入RNN的步
+        self.observed = []  # 待确认的 (步, 音高)
+        self.committed_steps = 0  # 已确认状态累计输入的步数
+        self.generated_steps = 0  # 推测分支累计采样的步数
+
+    def _step_of(self, tick_ms: int) -> int:
+        return int(round(tick_ms / self.step_ms))
+
+    # ---------------- 已确认状态 ----------------
+    def observe(self, drum_name: str, tick_ms: int):
+        """记录一次用户击打（不运行模型）"""
+        pitch = self.drum_to_midi.get(drum_name)
+        if pitch is None:
+            return
+        with self.lock:
+            self.observed.append((self._step_of(tick_ms), pitch))
+
+    def _catch_up(self):
+        """把最后一步之前的待确认击打与空步一次性输入RNN；最后一步可能还会有同步击打，留在待确认中"""
+        if not self.observed:
+            return
+        if self.committed_step is None:
+            self.committed_step = self.observed[0][0]
+        last_step = max(step for step, _ in self.observed)
+        if last_step <= self.committed_step:
+            return
+        events = [set() for _ in range(last_step - self.committed_step)]
+        remaining = []
+        for step, pitch in self.observed:
+            if step >= last_step:
+                remaining.append((step, pitch))
+            else:
+                # 晚到的击打归入尚未输入的第一步
+                events[max(step - self.committed_step, 0)].add(pitch)
+        self.stepper.feed([frozenset(e) for e in events])
+        self.committed_steps += len(events)
+        self.committed_step = last_step
+        self.observed = remaining
+
+    def _fork(self):
+        """返回 (分支, 分支待输入的步, 该步的事件)"""
+        with self.lock:
+            self._catch_up()
+            branch = self.stepper.fork()
+            pending = frozenset(pitch for _, pitch in self.observed)
+            return branch, self.committed_step, pending
+
+    # ---------------- 推测分支 ----------------
+    def stream(self, start_ms: int, end_ms=None):
+        """
+        从 start_ms（不早于最后一次击打的下一步）开始惰性生成，
+        每个有击打的步产出一次 (tick_ms, [鼓件名, ...])；end_ms 为 None 时无限生成
+        """
+        branch, from_step, pending = self._fork()
+        start_step = self._step_of(start_ms)
+        if from_step is None:
+            from_step, pending = start_step - 1, frozenset()  # 没有任何击打时以一个空步作为引子
+        start_step = max(start_step, from_step + 1)
+        end_step = None if end_ms is None else self._step_of(end_ms)
+
+        probs = branch.feed([pending] + [frozenset()] * (start_step - from_step - 1))
+        step = start_step
+        while end_step is None or step < end_step:
+            p = probs[:self.num_classes]
+            c = int(self.rng.choice(self.num_classes, p=p / p.sum()))
+            if self.class_drums[c]:
+                yield int(round(step * self.step_ms)), self.class_drums[c]
+            probs = branch.feed([self.class_events[c]])
+            self.generated_steps += 1
+            step += 1
+
+    def generate_window(self, start_ms: int, duration_ms: int):
+        """生成 [start_ms, start_ms + duration_ms) 内的击打，返回 [[tick_ms, 鼓件名], ...]"""
+        return [[t_ms, drum] for t_ms, drums in self.stream(start_ms, start_ms + duration_ms) for drum in drums]
+
+    def stats(self):
+        return {
+            "committed_steps": self.committed_steps,
+            "generated_steps": self.generated_steps,
+        }
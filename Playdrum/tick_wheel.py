@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class TickWheel:
+    """
+    播放缓冲的时间轮：num_slots 个刻度槽组成环，刻度 t 放在槽 t % num_slots。
+    只接受 [cursor, cursor + num_slots) 内的刻度，因此每个槽同一时间只属于一个刻度，
+    插入和清空单个槽都是 O(1)，不再需要扫描整个缓冲区清理旧刻度。
+    弹出和查找下一个非空刻度要看 [cursor, now] 及之后最多 num_slots 个槽，仍是 O(num_slots)，
+    但由 NumPy 在按槽的占用位图上向量化完成，Python 层只遍历真正有事件的槽。本身不加锁，由调用方串行化。
+    """
+
+    def __init__(self, num_slots: int, start_tick=0):
+        """
+        :param num_slots: 槽数，即可提前调度的最大刻度数
+        :param start_tick: 第一个待触发的刻度
+        """
+        self.num_slots = num_slots
+        self.slot_ticks = [0] * num_slots
+        self.slot_events = [None] * num_slots  # None 表示空槽
+        self.occupied = np.zeros(num_slots, dtype=bool)  # 槽占用位图
+        self.cursor = start_tick  # 下一个待触发的刻度
+        self.pending = 0  # 非空槽数
+        self._next = None  # 最早的非空刻度
+        self.late_inserts = 0  # 插入时已过期、改到 cursor 触发的次数
+        self.rejected = 0  # 超出可调度范围而丢弃的次数
+
+    def __len__(self):
+        return self.pending
+
+    def next_tick(self):
+        """最早的待触发刻度，没有时返回 None"""
+        return self._next
+
+    def advance_to(self, now_tick: int):
+        """
+        空轮时把 cursor 移到 now_tick：播放线程只在有刻度到期时推进 cursor，
+        长时间空闲后若不前移，之后的刻度都会超出 [cursor, cursor + num_slots) 而被丢弃。
+        非空时待触发的刻度由 pop_due 按时清空，cursor 不能越过它们。
+        """
+        if not self.pending and now_tick > self.cursor:
+            self.cursor = now_tick
+
+    def insert(self, tick: int, event) -> bool:
+        """在 tick 上加入一个事件；已过期的刻度改到 cursor 立即触发，超出范围返回 False"""
+        if tick < self.cursor:
+            tick = self.cursor
+            self.late_inserts += 1
+        if tick - self.cursor >= self.num_slots:
+            self.rejected += 1
+            return False
+        slot = tick % self.num_slots
+        events = self.slot_events[slot]
+        if events is None:
+            self.slot_events[slot] = [event]
+            self.slot_ticks[slot] = tick
+            self.occupied[slot] = True
+            self.pending += 1
+            if self._next is None or tick < self._next:
+                self._next = tick
+        else:
+            events.append(event)
+        return True
+
+    def insert_many(self, ticks, events) -> int:
+        """批量插入（一次加锁内完成整段调度），返回成功插入的事件数"""
+        inserted = 0
+        for tick, event in zip(ticks, events):
+            inserted += self.insert(tick, event)
+        return inserted
+
+    def pop_due(self, now_tick: int):
+        """弹出所有 <= now_tick 的刻度，返回按刻度排序的 [(tick, [事件, ...]), ...]，cursor 前进到 now_tick + 1"""
+        due = []
+        span = now_tick - self.cursor + 1
+        if span <= 0:
+            return due
+        if self.pending:
+            # 长时间空闲后 span 可能超过一圈，此时所有槽都只需检查一次；只遍历位图中被占用的槽
+            slots = np.arange(self.cursor, self.cursor + min(span, self.num_slots)) % self.num_slots
+            for slot in slots[self.occupied[slots]].tolist():
+                if self.slot_ticks[slot] <= now_tick:
+                    due.append((self.slot_ticks[slot], self.slot_events[slot]))
+                    self.slot_events[slot] = None
+                    self.occupied[slot] = False
+                    self.pending -= 1
+            due.sort(key=lambda item: item[0])
+        self.cursor = now_tick + 1
+        self._next = self._scan()
+        return due
+
+    def _scan(self):
+        """在占用位图上从 cursor 所在槽起找到最早的非空刻度（待触发刻度都在 [cursor, cursor + num_slots) 内）"""
+        if not self.pending:
+            return None
+        start = self.cursor % self.num_slots
+        after = self.occupied[start:]
+        i = int(after.argmax())
+        if after[i]:
+            return self.slot_ticks[start + i]
+        return self.slot_ticks[int(self.occupied[:start].argmax())]